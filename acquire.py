@@ -1,10 +1,34 @@
 import numpy as np
 import pandas as pd
+import requests
 from requests import get
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from urllib.parse import urlsplit
+import threading
+import os
+import glob
+import sqlite3
+import hashlib
+import json
+import zlib
+#get_last_page now lives in extractors.py with the other parsing code
+from extractors import extractors, get_last_page
+import metrics
 import re
 import time
 
+#All requests identify themselves with the same user agent
+headers = {'user-agent': 'Codeup DS Germain'}
+
+#Seconds to wait for a connection, and then for each read, before a request counts as failed
+timeout = (10, 60)
+
+#The status code given to a request that timed out or could not connect, as other HTTP clients do.
+#Like any other status but 200 it is reported and retried on the next run
+failed_status = 599
+
 #Since there are only 4 overall genres, I will manually grab those urls.
 genres = [{
             'genre': 'Horror',
@@ -23,40 +47,534 @@ genres = [{
               'url': 'https://www.barnesandnoble.com/b/books/science-fiction-fantasy/_/N-29Z8q8Z180l'
           }]
 
-def get_sub_genre_urls(genre_list = genres):
+def make_session(pool_size = 10):
+    """
+    This function creates and returns a requests session whose connection pool can hold
+    pool_size open connections per host. Reusing one session keeps connections alive between
+    requests instead of opening a new one for every page.
+    """
+    #Create the session and an adapter with a large enough pool for every worker
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+
+    #Use the pooled adapter for both http and https urls
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that no single host receives more than max_rate requests per second.
+    Safe to share between threads. A max_rate of None disables the limit.
+    """
+
+    def __init__(self, max_rate = None):
+        self.interval = 1 / max_rate if max_rate else 0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        """
+        Block until the host of the given url may be requested again.
+        """
+        if not self.interval:
+            return
+
+        host = urlsplit(url).netloc
+
+        #Reserve the next free slot for this host while holding the lock,
+        #then sleep outside of it so other hosts are not held up
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+
+        if slot > now:
+            metrics.observe('rate_limit_wait_seconds', slot - now, host = host)
+            time.sleep(slot - now)
+
+
+class ResponseCache:
+    """
+    A persistent on-disk cache of page bodies keyed by url. Bodies are stored zlib compressed
+    in a SQLite file so reruns can be served locally. Once an entry is older than max_age seconds
+    it is revalidated with a conditional request (ETag / Last-Modified), and the least recently
+    used entries are evicted whenever the stored bodies grow past max_bytes.
+
+    max_age defaults to one day. A full crawl takes hours, so a rerun after a crash serves every page
+    it already has without a request, while the next day's crawl still sees new listings. Pass 0 to
+    revalidate every entry.
+    """
+
+    def __init__(self, path = 'http_cache.sqlite', max_bytes = 2 * 1024 ** 3, max_age = 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        #The connection is shared by the fetching threads, so guard it with a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                 url TEXT PRIMARY KEY,
+                                 etag TEXT,
+                                 last_modified TEXT,
+                                 body BLOB,
+                                 size INTEGER,
+                                 fetched REAL,
+                                 last_used REAL)""")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.conn.commit()
+
+        #Keep a running total of the stored bytes so eviction does not have to re-sum the table
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, url, session = None, limiter = None):
+        """
+        Return the response for url, from the cache when possible. Pages that are still fresh
+        are served without touching the network. Stale pages are revalidated, and a 304 reply
+        is turned back into a 200 response carrying the cached body. Only requests that go out
+        wait on the given RateLimiter.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT etag, last_modified, body, fetched FROM responses WHERE url = ?',
+                                    (url,)).fetchone()
+
+        request_headers = dict(headers)
+
+        if row is not None:
+            etag, last_modified, body, fetched = row
+
+            #Serve fresh entries straight from disk
+            if time.time() - fetched < self.max_age:
+                metrics.count('cache', result = 'fresh')
+                self.touch(url)
+                return self.build_response(url, zlib.decompress(body))
+
+            #Otherwise ask the server whether the page has changed
+            if etag:
+                request_headers['If-None-Match'] = etag
+            if last_modified:
+                request_headers['If-Modified-Since'] = last_modified
+
+        if limiter is not None:
+            limiter.wait(url)
+
+        getter = session.get if session is not None else get
+        response = timed_get(getter, url, request_headers)
+
+        if response.status_code == 304 and row is not None:
+            metrics.count('cache', result = 'revalidated')
+            self.touch(url, revalidated = True)
+            return self.build_response(url, zlib.decompress(body))
+
+        metrics.count('cache', result = 'miss')
+
+        if response.status_code == 200:
+            self.store(url, response)
+
+        return response
+
+    def store(self, url, response):
+        """
+        Compress and save the body of a successful response, evicting old entries if needed.
+        """
+        body = zlib.compress(response.content)
+        now = time.time()
+
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                               body, len(body), now, now))
+            self.total_bytes += len(body)
+
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        The caller must hold the lock.
+        """
+        while self.total_bytes > self.max_bytes:
+            row = self.conn.execute('SELECT url, size FROM responses ORDER BY last_used LIMIT 1').fetchone()
+            if row is None:
+                break
+
+            self.conn.execute('DELETE FROM responses WHERE url = ?', (row[0],))
+            self.total_bytes -= row[1]
+
+    def touch(self, url, revalidated = False):
+        """
+        Mark an entry as recently used. A revalidated entry also counts as freshly fetched.
+        """
+        now = time.time()
+
+        with self.lock:
+            if revalidated:
+                self.conn.execute('UPDATE responses SET last_used = ?, fetched = ? WHERE url = ?', (now, now, url))
+            else:
+                self.conn.execute('UPDATE responses SET last_used = ? WHERE url = ?', (now, url))
+            self.conn.commit()
+
+    @staticmethod
+    def build_response(url, body):
+        """
+        Wrap a cached body in a 200 response so callers cannot tell it apart from a live one.
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = body
+
+        return response
+
+    def close(self):
+        self.conn.close()
+
+
+class CrawlJournal:
+    """
+    A durable record of crawl progress kept in a SQLite file. It stores every finished sub-genre
+    listing page with the book urls found on it, and every finished book with its blurb (None for
+    books that had no description). A restarted crawl that is given the same journal skips
+    everything already recorded.
+    """
+
+    def __init__(self, path = 'crawl_journal.sqlite'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+
+        #WAL mode makes the frequent small commits cheap while staying crash safe
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                                 url TEXT PRIMARY KEY,
+                                 books TEXT,
+                                 last_page INTEGER)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS books (
+                                 url TEXT PRIMARY KEY,
+                                 blurb TEXT)""")
+        self.conn.commit()
+
+    def get_page(self, url):
+        """
+        Return (books, last_page) for a recorded listing page, or None if it has not been done.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT books, last_page FROM pages WHERE url = ?', (url,)).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0]), row[1]
+
+    def record_page(self, url, books, last_page = None):
+        """
+        Checkpoint a finished listing page and the book dictionaries scraped from it.
+        """
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', (url, json.dumps(books), last_page))
+            self.conn.commit()
+
+    def get_books(self, urls):
+        """
+        Return a dictionary mapping each recorded url in urls to its blurb.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT url, blurb FROM books').fetchall()
+
+        urls = set(urls)
+
+        return {url: blurb for url, blurb in rows if url in urls}
+
+    def record_book(self, url, blurb):
+        """
+        Checkpoint a finished book. Pass None as the blurb for books without a description.
+        """
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO books VALUES (?, ?)', (url, blurb))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class CrawlIndex:
+    """
+    A persistent index, kept in a SQLite file, of every book seen by earlier crawls. For each book
+    url it keeps the genre, sub-genre, blurb (None for books without one), a fingerprint of the
+    blurb, the status code of its last fetch, and when the book was first and last seen.
+    Incremental crawls use it to fetch only the books that are new, and to tell which rechecked
+    books have changed. Books whose fetch failed are kept too, so they count as seen.
+    """
+
+    def __init__(self, path = 'crawl_index.sqlite'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS books (
+                                 url TEXT PRIMARY KEY,
+                                 genre TEXT,
+                                 sub_genre TEXT,
+                                 blurb TEXT,
+                                 fingerprint TEXT,
+                                 first_seen REAL,
+                                 last_seen REAL,
+                                 status INTEGER)""")
+
+        #Indexes written before failures were recorded have no status column
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(books)')]
+        if 'status' not in columns:
+            self.conn.execute('ALTER TABLE books ADD COLUMN status INTEGER DEFAULT 200')
+
+        self.conn.commit()
+
+    @staticmethod
+    def fingerprint(blurb):
+        """
+        Return a short hash of a blurb. Only the description is hashed, so changes elsewhere
+        on the page (prices, ads, reviews) do not count as changes to the book.
+        """
+        if blurb is None:
+            return None
+
+        return hashlib.sha1(blurb.encode('utf-8')).hexdigest()
+
+    def known(self, urls):
+        """
+        Return the set of urls in urls that are already in the index.
+        """
+        urls = list(urls)
+        found = set()
+
+        #Look the urls up in batches to stay under SQLite's limit on query parameters
+        with self.lock:
+            for i in range(0, len(urls), 500):
+                batch = urls[i:i + 500]
+                rows = self.conn.execute(f'SELECT url FROM books WHERE url IN ({",".join("?" * len(batch))})',
+                                         batch).fetchall()
+                found.update(row[0] for row in rows)
+
+        return found
+
+    def touch(self, urls):
+        """
+        Mark books as seen in the current crawl's listings.
+        """
+        now = time.time()
+
+        with self.lock:
+            self.conn.executemany('UPDATE books SET last_seen = ? WHERE url = ?', [(now, url) for url in urls])
+            self.conn.commit()
+
+    def record(self, book, blurb):
+        """
+        Store a fetched book and its blurb, and return whether it was 'new', 'changed', or 'unchanged'.
+        """
+        fingerprint = self.fingerprint(blurb)
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute('SELECT fingerprint FROM books WHERE url = ?', (book['url'],)).fetchone()
+
+            if row is None:
+                status = 'new'
+                self.conn.execute('INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, 200)',
+                                  (book['url'], book['genre'], book['sub-genre'], blurb, fingerprint, now, now))
+            else:
+                status = 'unchanged' if row[0] == fingerprint else 'changed'
+                self.conn.execute('UPDATE books SET blurb = ?, fingerprint = ?, last_seen = ?, status = 200 WHERE url = ?',
+                                  (blurb, fingerprint, now, book['url']))
+
+            self.conn.commit()
+
+        return status
+
+    def record_failure(self, book, status_code):
+        """
+        Store a book whose page could not be fetched, with the response's status code, so later
+        crawls count it as seen. A book already in the index keeps its blurb. Pass recheck = True
+        to iter_incremental_data to try failed books again.
+        """
+        now = time.time()
+
+        with self.lock:
+            self.conn.execute('INSERT INTO books VALUES (?, ?, ?, NULL, NULL, ?, ?, ?) '
+                              'ON CONFLICT (url) DO UPDATE SET status = excluded.status, last_seen = excluded.last_seen',
+                              (book['url'], book['genre'], book['sub-genre'], now, now, status_code))
+            self.conn.commit()
+
+    def failed(self):
+        """
+        Return the urls of the books whose last fetch failed, mapped to its status code.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT url, status FROM books WHERE status != 200').fetchall()
+
+        return dict(rows)
+
+    def to_frame(self):
+        """
+        Return every indexed book that has a blurb as a dataframe with the same columns acquire_data returns.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT genre, sub_genre, blurb FROM books WHERE blurb IS NOT NULL ORDER BY rowid').fetchall()
+
+        return pd.DataFrame(rows, columns = ['genre', 'sub-genre', 'blurb'])
+
+    def close(self):
+        self.conn.close()
+
+
+def send(getter, url, request_headers):
+    """
+    This function makes one request with getter (requests.get or a session's get), giving up after
+    timeout. A request that times out or cannot connect does not raise. It returns an empty response
+    with failed_status instead, so the crawl treats it like any other failed page and carries on.
+    """
+    try:
+        return getter(url, headers = request_headers, timeout = timeout)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as error:
+        metrics.count('request_errors', error = type(error).__name__)
+
+        response = requests.Response()
+        response.status_code = failed_status
+        response.url = url
+        response.reason = str(error)
+        response._content = b''
+
+        return response
+
+
+def timed_get(getter, url, request_headers):
+    """
+    This function makes one request with getter (requests.get or a session's get) through send and
+    returns the response. While metrics are enabled it records the request's latency, status code
+    and the bytes downloaded.
+    """
+    if metrics.sink is None:
+        return send(getter, url, request_headers)
+
+    start = time.perf_counter()
+    response = send(getter, url, request_headers)
+
+    metrics.observe('request_seconds', time.perf_counter() - start, host = urlsplit(url).netloc)
+    metrics.count('responses', status = response.status_code)
+    metrics.count('bytes_downloaded', len(response.content))
+
+    return response
+
+
+def fetch(url, session = None, cache = None, limiter = None):
+    """
+    This function requests a single url and returns the response. The request goes through
+    the given ResponseCache when one is provided, and through the given session otherwise.
+    The given RateLimiter is waited on only when a request is actually sent, so pages served
+    fresh from the cache are not throttled.
+    """
+    if cache is not None:
+        return cache.get(url, session, limiter)
+
+    if limiter is not None:
+        limiter.wait(url)
+
+    getter = session.get if session is not None else get
+
+    return timed_get(getter, url, headers)
+
+
+def fetch_all(urls, workers = 1, max_rate = None, session = None, cache = None, limiter = None):
+    """
+    This function takes in an iterable of urls and yields their responses in the same order
+    the urls were given. With workers greater than 1 the requests are made by a thread pool
+    over one shared, pooled session, with at most workers * 2 requests in flight at once.
+    max_rate caps the number of requests per second sent to any one host. Requests go through
+    the given ResponseCache when one is provided, and pages it serves fresh do not count
+    against max_rate.
+
+    A new RateLimiter only spaces out the requests of this one call. Pass the same limiter (and
+    session) to every call of a crawl so that max_rate holds across all of them.
+    """
+    #Create a pooled session and a rate limiter if they were not provided
+    if session is None:
+        session = make_session(max(workers, 1))
+
+    if limiter is None:
+        limiter = RateLimiter(max_rate)
+
+    def fetch_one(url):
+        return fetch(url, session, cache, limiter)
+
+    #With a single worker there is no need for a thread pool
+    if workers <= 1:
+        for url in urls:
+            yield fetch_one(url)
+        return
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        #Keep a bounded window of requests in flight and hand back
+        #the oldest one first so the original order is preserved
+        pending = deque()
+
+        for url in urls:
+            pending.append(executor.submit(fetch_one, url))
+
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_sub_genre_urls(genre_list = genres, cache = None, extractor = 'soup', workers = 1, max_rate = None, session = None,
+                       limiter = None):
     """
     This function takes in a list of dictionaries containing urls for the Horror, Romance, Mystery and Crime, and Sci-fi and Fantasy genres
     at barnesandnoble.com. Each dictionary also has the name of the genre for the link. 
     It then loops through each of them, web scrapes the urls for each
     sub genre, and finally returns a list of those urls.
+
+    Pages are read through the given ResponseCache when one is provided. extractor names the
+    backend from extractors.py used to pull the links out of each page. The genre pages are
+    requested through fetch_all, which takes workers, max_rate, session, and limiter.
     """
     #Create empty list to contain genre name and sub-genre url dicts
     sub_genres = []
     
-    #Loop through each url in the genre_list
-    for genre in genre_list:
-        #Get the web content of the main genre
-        response = get(genre['url'], headers = {'user-agent': 'Codeup DS Germain'})
-        
-        #Check status code, print message
+    #Get the web content of every main genre
+    responses = fetch_all([genre['url'] for genre in genre_list], workers = workers, max_rate = max_rate,
+                          session = session, cache = cache, limiter = limiter)
+    
+    #Loop through each genre in the genre_list
+    for genre, response in zip(genre_list, responses):
+        #Check status code, leave a message
         if response.status_code == 200:
-            print(f'Response status code: {response.status_code}. The {genre["genre"]} genre is good to go.')
+            metrics.event('genre_page', f'Response status code: {response.status_code}. The {genre["genre"]} genre is good to go.',
+                          genre = genre['genre'], status = response.status_code)
         else:
-            print(f'Response status code: {response.status_code}. Something went wrong with the {genre["genre"]} genre!')
+            metrics.event('genre_page_failed', f'Response status code: {response.status_code}. Something went wrong with the {genre["genre"]} genre!',
+                          genre = genre['genre'], status = response.status_code)
+
+            #An error page has no sub-genres to parse. Carry on with the other genres
+            continue
             
-        #Parse the response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        #Find the list of sub-genres
-        sub_genre_list = soup.find('ul', id = 'sidebar-section-0')
-        
-        #Now find all the anchor tags that contain the urls for each sub-genre
-        links = sub_genre_list.find_all('a')
+        #Find the urls in the list of sub-genres
+        with metrics.timer('parse_seconds', page = 'genre'):
+            links = extractors[extractor].sub_genre_links(response.content)
         
         #Loop through each item in the links list
         for link in links:
             #Build the complete link
-            complete_link = 'https://www.barnesandnoble.com' + link.attrs['href']
+            complete_link = 'https://www.barnesandnoble.com' + link
 
             #Everything after the semicolon in the url is not needed. Remove it
             complete_link = re.sub(r';.*', '', complete_link)
@@ -73,104 +591,196 @@ def get_sub_genre_urls(genre_list = genres):
 
 
 
-def get_last_page(soup):
+def get_page_books(links, sub_genre):
     """
-    This function takes in the content of an html page. It should be the first page for 
-    any sub-genre. It will find and return the number corresponding to the last page 
-    available for the sub-genre.
+    This function takes in the book links found on one sub-genre listing page and the sub-genre's dictionary.
+    It returns a list of dictionaries, one for each book on the page, containing the book's genre,
+    sub-genre, and url.
     """
-    #Now, find out how many pages there are in the sub-genre
-    page_list = soup.find('ul', class_ = 'pagination search-pagination')
+    #Create an empty list to hold the book dictionaries
+    books = []
 
-    #Now gather the anchor tags in the list
-    a_tags = page_list.find_all('a')
-    
-    #Since the last anchor tag is for the very next page,
-    #Select the second to last anchor tag. It will have the number associated with 
-    #the last page in the sub-genre
-    last_page = int(a_tags[-2].text.split('\n')[2])
-    
-    return last_page
+    #Loop through each item in the links list
+    for link in links:
+        #Build the complete link
+        complete_link = 'https://www.barnesandnoble.com' + link
 
+        #Everything after the semicolon in the url is not needed. Remove it
+        complete_link = re.sub(r';.*', '', complete_link)
 
-def get_book_urls(sub_genres):
+        #Create a temp_dict to store info
+        temp_dict = {'genre': sub_genre['genre'],
+                     'sub-genre': sub_genre['sub-genre'],
+                     'url': complete_link}
+
+        #Append the new link to the list
+        books.append(temp_dict)
+
+    return books
+
+
+def get_book_urls(sub_genres, cache = None, journal = None, workers = 1, max_rate = None, session = None, extractor = 'soup',
+                  limiter = None):
     """
     This function takes in a dictionary of sub-genre urls. It will loop through each of them
     and gather the individual book urls from all available pages in the sub-genre.
     It will return a list of dictionaries, with each dictionary containing the book's 
     overall genre and the individual book's url.
+
+    The first page of every sub-genre is requested first, to learn how many pages each one has.
+    After that, every remaining page of every sub-genre is scheduled at once, and with workers
+    greater than 1 those pages are fetched concurrently while the main thread parses them.
+    The books are always returned in (sub-genre, page) order. max_rate caps the requests per
+    second sent to the site.
+
+    Pages are read through the given ResponseCache when one is provided. When a CrawlJournal
+    is provided, every finished listing page is recorded in it and pages it already holds
+    are not requested again. Pages that come back with an error status are reported and left
+    out, and the crawl carries on without them. Failed pages after the first are requested once
+    more when every other page is done, and those that fail again are listed in one last report. extractor names the backend from extractors.py used to pull
+    the book links out of each page. limiter is a RateLimiter shared with the rest of the crawl
+    (see fetch_all).
     """
-    #First create an empty list to hold the book dictionaries
-    book_urls = []
-    
-    #Now loop through each sub-genre
-    for sub_genre in sub_genres:
-        #Get the initial page for the sub-genre
-        response = get(sub_genre['url'], headers = {'user-agent':'Codeup DS Germain'})
-        
+    #Both rounds of requests share one session and one rate limit
+    if session is None:
+        session = make_session(max(workers, 1))
+
+    if limiter is None:
+        limiter = RateLimiter(max_rate)
+
+    #Map each (sub-genre position, page number) to the books found on that page
+    page_books = {}
+
+    #Keep track of the last page of each sub-genre
+    last_pages = {}
+
+    #Check which first pages were finished by an earlier run
+    first_pages = []
+
+    for n, sub_genre in enumerate(sub_genres):
+        page = journal.get_page(sub_genre['url']) if journal is not None else None
+
+        if page is None:
+            first_pages.append((n, sub_genre))
+        else:
+            page_books[(n, 1)], last_pages[n] = page
+
+    #Get the initial page of every remaining sub-genre
+    responses = fetch_all([sub_genre['url'] for n, sub_genre in first_pages],
+                          workers = workers, session = session, cache = cache, limiter = limiter)
+
+    for (n, sub_genre), response in zip(first_pages, responses):
         #Check response
         if response.status_code == 200:
-            print(f'Got first page of sub-genre: {sub_genre["genre"]}, {sub_genre["sub-genre"]}')
+            metrics.event('listing_page', f'Got first page of sub-genre: {sub_genre["genre"]}, {sub_genre["sub-genre"]}',
+                          genre = sub_genre['genre'], sub_genre = sub_genre['sub-genre'], page = 1)
         else:
-            print(f'Something went wrong at {sub_genre["genre"]}, {sub_genre["sub-genre"]}. Status code: {response.status_code}')
-        
-        #Parse it 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        #Get the number corresponding to the last available page for the sub-genre
-        last_page = get_last_page(soup)
+            metrics.event('listing_page_failed', f'Something went wrong at {sub_genre["genre"]}, {sub_genre["sub-genre"]}. Status code: {response.status_code}',
+                          genre = sub_genre['genre'], sub_genre = sub_genre['sub-genre'], page = 1, status = response.status_code)
+
+            #Without its first page the sub-genre has no known pages. It is not journaled,
+            #so the next run requests it again
+            last_pages[n] = 0
+            continue
         
-        #Now increment through the pages
-        for i in range(2, last_page + 1):
-            
-            #Scrape all book urls on the current page
-            #Grab the section that contains all of the books on the page
-            book_container = soup.find('div', class_ = 'product-shelf-grid')
-            
-            #Now get all the links for each book
-            book_anchors = book_container.find_all('a', class_ = 'pImageLink')
-    
-            #Loop through each item in the links list
-            for anchor in book_anchors:
-                #Build the complete link
-                complete_link = 'https://www.barnesandnoble.com' + anchor.attrs['href']
-
-                #Everything after the semicolon in the url is not needed. Remove it
-                complete_link = re.sub(r';.*', '', complete_link)
-
-                #Create a temp_dict to store info
-                temp_dict = {'genre': sub_genre['genre'],
-                             'sub-genre': sub_genre['sub-genre'],
-                             'url': complete_link}
-
-                #Append the new link to the list
-                book_urls.append(temp_dict)
-                
-            #Now create the url for the next page
+        #Get the books on the first page and the number corresponding to
+        #the last available page for the sub-genre
+        with metrics.timer('parse_seconds', page = 'listing'):
+            links, last_pages[n] = extractors[extractor].listing_page(response.content, last_page = True)
+        page_books[(n, 1)] = get_page_books(links, sub_genre)
+
+        #Only good pages get this far, so failures are retried on the next run
+        if journal is not None:
+            journal.record_page(sub_genre['url'], page_books[(n, 1)], last_pages[n])
+
+    #Now that every last page is known, build the list of all the remaining pages
+    other_pages = []
+
+    for n, sub_genre in enumerate(sub_genres):
+        for i in range(2, last_pages[n] + 1):
+            #Now create the url for the page
             #I believe Nrpp stands for Num results per page, so we can change that if we want
-            next_page = sub_genre['url'] + '?Nrpp=20&page=' + str(i)
-            
-            #Now get the content of the next page
-            response = get(next_page, headers = {'user-agent': 'Codeup DS Germain'})
-            
+            url = sub_genre['url'] + '?Nrpp=20&page=' + str(i)
+
+            page = journal.get_page(url) if journal is not None else None
+
+            if page is None:
+                other_pages.append((n, i, url))
+            else:
+                page_books[(n, i)] = page[0]
+
+    #Fetch all of them at once. Parsing happens here while the next pages are still downloading.
+    #Pages that fail are collected and requested once more after the pool has drained
+    for attempt in range(2):
+        responses = fetch_all([url for n, i, url in other_pages],
+                              workers = workers, session = session, cache = cache, limiter = limiter)
+
+        failed_pages = []
+
+        for (n, i, url), response in zip(other_pages, responses):
             #Check the response code again
             if response.status_code == 200:
-                print(f'Acquired page {i} of {last_page} pages.')
+                metrics.event('listing_page', f'Acquired page {i} of {last_pages[n]} pages.',
+                              genre = sub_genres[n]['genre'], sub_genre = sub_genres[n]['sub-genre'], page = i)
             else:
-                print(f'Something went wrong at page {i} of {last_page} pages! Status Code: {response.status_code}')
-            
-            #Now parse and update the soup variable for the next loop iteration
-            soup = BeautifulSoup(response.content, 'html.parser')
+                metrics.event('listing_page_failed', f'Something went wrong at page {i} of {last_pages[n]} pages! Status Code: {response.status_code}',
+                              genre = sub_genres[n]['genre'], sub_genre = sub_genres[n]['sub-genre'], page = i,
+                              status = response.status_code)
+
+                #Leave the page out, and out of the journal, rather than parse an error page
+                page_books[(n, i)] = []
+                failed_pages.append((n, i, url))
+                continue
+
+            #Now scrape all book urls on the page
+            with metrics.timer('parse_seconds', page = 'listing'):
+                links, _ = extractors[extractor].listing_page(response.content)
+            page_books[(n, i)] = get_page_books(links, sub_genres[n])
+
+            if journal is not None:
+                journal.record_page(url, page_books[(n, i)])
+
+        other_pages = failed_pages
+
+        if not other_pages:
+            break
+
+    if other_pages:
+        metrics.event('listing_pages_failed', f'{len(other_pages)} listing pages failed twice and were left out: '
+                      + ', '.join(f'page {i} of {sub_genres[n]["sub-genre"]}' for n, i, url in other_pages),
+                      pages = [url for n, i, url in other_pages])
+
+    #Finally, put the books together in (sub-genre, page) order
+    book_urls = []
+    
+    for n in range(len(sub_genres)):
+        for i in range(1, last_pages[n] + 1):
+            book_urls.extend(page_books[(n, i)])
             
     return book_urls
 
 
-def get_book_blurbs(book_urls):
+def iter_book_blurbs(book_urls, workers = 1, max_rate = None, session = None, cache = None, journal = None,
+                     extractor = 'soup', limiter = None):
     """
     This function takes in a list of dictionaries that contain a book's overall genre, its sub-genre,
     and its unique url. This function will loop through each url in the given list of dictionaries,
-    and scrape the description of each book. It will finally return a new list of dictionaries with 
-    the books' descriptions included. It will also keep track of how long the function runs.
+    and scrape the description of each book. It is a generator: it yields a dictionary with each
+    book's description included as soon as that book is done, so nothing has to wait for the whole
+    list. It will also keep track of how long the function runs.
+
+    Setting workers above 1 fetches the pages concurrently over a shared, pooled session. max_rate
+    caps the requests per second sent to the site. The returned records, their order, and the
+    number of skipped books are the same either way. Pages are read through the given
+    ResponseCache when one is provided.
+
+    When a CrawlJournal is provided, each finished book (including skipped ones) is recorded in it
+    as soon as it is done, and books it already holds are taken from it instead of being fetched.
+    extractor names the backend from extractors.py used to pull the description out of each page.
+    limiter is a RateLimiter shared with the rest of the crawl (see fetch_all).
+
+    Progress, failed requests and skipped books are reported through metrics.event, which prints
+    them unless a metrics sink has been set. See metrics.py for what else is recorded.
     """
     #Start the timer
     time_start = time.perf_counter()
@@ -181,8 +791,12 @@ def get_book_blurbs(book_urls):
     #Create a variable to keep track of the number of books that have been processed
     book_number = 0
     
-    #Create the empty list to store the dictionaries
-    book_blurbs = []
+    #Look up the books that were finished by an earlier run
+    done = journal.get_books([book['url'] for book in book_urls]) if journal is not None else {}
+    
+    #Start fetching the remaining pages. Responses come back in the same order as book_urls
+    responses = fetch_all([book['url'] for book in book_urls if book['url'] not in done],
+                          workers = workers, max_rate = max_rate, session = session, cache = cache, limiter = limiter)
     
     #Now loop through each book url in the 'book_urls'
     for book in book_urls:
@@ -191,25 +805,39 @@ def get_book_blurbs(book_urls):
         
         #Every 100 entries, leave a progress message
         if book_number % 100 == 0:
-            print(f'Total Entries So Far: {book_number}')
-            print(f'Total Entries Left: {len(book_urls) - book_number}')
-            print(f'Total Time So Far: { (time.perf_counter() - time_start) / 60} minutes\n')
+            elapsed = time.perf_counter() - time_start
+
+            metrics.event('progress', f'Total Entries So Far: {book_number}\n'
+                                      f'Total Entries Left: {len(book_urls) - book_number}\n'
+                                      f'Total Time So Far: {elapsed / 60} minutes\n',
+                          done = book_number, left = len(book_urls) - book_number, seconds = elapsed)
+        
+        #Books finished by an earlier run only need to be counted
+        if book['url'] in done:
+            metrics.count('books', result = 'journal')
+
+            if done[book['url']] is None:
+                books_skipped += 1
+            else:
+                yield {'genre': book['genre'],
+                       'sub-genre': book['sub-genre'],
+                       'blurb': done[book['url']]}
+            continue
         
-        #Get the page content
-        response = get(book['url'], headers = {'user-agent': 'Codeup DS Germain'})
+        response = next(responses)
         
         #Check the status code. If there is a problem, leave a message
         if response.status_code != 200:
-            print(f'Something went wrong at book url #{book_number}! Status Code: {response.status_code}')
-            print(f'Genre, Subgenre: {book["genre"]}, {book["sub-genre"]}')
-            print(f'Book URL: {book["url"]}')
+            metrics.count('books', result = 'failed')
+            metrics.event('book_failed', f'Something went wrong at book url #{book_number}! Status Code: {response.status_code}\n'
+                                         f'Genre, Subgenre: {book["genre"]}, {book["sub-genre"]}\n'
+                                         f'Book URL: {book["url"]}',
+                          url = book['url'], number = book_number, status = response.status_code)
             continue
         
-        #parse it
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
         #Get the description
-        blurb = soup.find('div', itemprop = 'description')
+        with metrics.timer('parse_seconds', page = 'book'):
+            blurb = extractors[extractor].blurb(response.content)
         
         #For testing
         #print(f"Current URL: {book['url']}")
@@ -219,11 +847,16 @@ def get_book_blurbs(book_urls):
         #Remove leading and trailing whitespace and '\xa0'
         #Otherwise, continue the loop
         if blurb != None:
-            blurb = blurb.text.strip().replace('\xa0 ', '')
+            blurb = blurb.strip().replace('\xa0 ', '')
         else:
             books_skipped += 1
-            print(f"Book Skipped! URL: {book['url']}")
-            print(f"Book Number: {book_number}\n")
+            metrics.count('books', result = 'skipped')
+            metrics.event('book_skipped', f"Book Skipped! URL: {book['url']}\nBook Number: {book_number}\n",
+                          url = book['url'], number = book_number)
+
+            #Record the skip so it is not retried
+            if journal is not None:
+                journal.record_book(book['url'], None)
             continue
         
         #Create temp dict
@@ -232,34 +865,137 @@ def get_book_blurbs(book_urls):
                      'blurb': blurb
                     }
         
-        #Append the temp_dict to the book_blurbs list
-        book_blurbs.append(temp_dict)
+        #Checkpoint the book before handing it on
+        if journal is not None:
+            journal.record_book(book['url'], blurb)
+        
+        metrics.count('books', result = 'ok')
+        yield temp_dict
         
         #For testing
         #print(f'Book Number #{book_number} Complete.')
         
     #Inform the user that the function is done. Provide total time
-    print(f'Function Complete! Total Time: { (time.perf_counter() - time_start) / 60 / 60} hours')
-    print(f'Total Books Skipped: {books_skipped}')
-    
-    return book_blurbs
+    elapsed = time.perf_counter() - time_start
+
+    metrics.observe('stage_seconds', elapsed, stage = 'get_book_blurbs')
+    metrics.count('stage_rows', len(book_urls), stage = 'get_book_blurbs')
+    metrics.event('complete', f'Function Complete! Total Time: {elapsed / 60 / 60} hours\n'
+                              f'Total Books Skipped: {books_skipped}',
+                  books = len(book_urls), skipped = books_skipped, seconds = elapsed)
 
-def acquire_data(genre_list = genres):
+
+def get_book_blurbs(book_urls, workers = 1, max_rate = None, session = None, cache = None, journal = None,
+                    extractor = 'soup', limiter = None):
     """
-    This function puts all of the above functions together and allows the user to gather all of the data with just one function call.
+    This function takes in a list of dictionaries that contain a book's overall genre, its sub-genre,
+    and its unique url, and returns a new list of dictionaries with the books' descriptions included.
+    It takes the same arguments as iter_book_blurbs, which does the actual work.
+    """
+    return list(iter_book_blurbs(book_urls, workers = workers, max_rate = max_rate, session = session,
+                                 cache = cache, journal = journal, extractor = extractor, limiter = limiter))
 
-    Parameters:
-        genre_list: The initial list of overall genre URL's.
 
-    Returns:
-        A dataframe containing each book's genre, sub-genre, and original description.
+class ChunkWriter:
+    """
+    Writes records to numbered chunk files (part-00000.jsonl, part-00001.jsonl, ...) of chunk_size
+    records each, in 'jsonl' or 'parquet' format, so memory stays bounded by one chunk. Each chunk
+    is written under a temporary name and renamed into place once complete, so a reader only ever
+    sees finished chunks. Closing the writer flushes the last chunk and writes a 'done' marker file.
+    Used as a context manager, it writes a 'failed' marker holding the error instead if the crawl
+    raises, so readers following the output know to stop waiting.
+    """
+
+    def __init__(self, directory, chunk_size = 1000, file_format = 'jsonl'):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.records = []
+        self.paths = []
+
+        #Clear out chunks left over from an earlier run so they are not mixed in
+        os.makedirs(directory, exist_ok = True)
+        for path in glob.glob(os.path.join(directory, 'part-*')) + glob.glob(os.path.join(directory, 'done')) + \
+                    glob.glob(os.path.join(directory, 'failed')):
+            os.remove(path)
+
+    def write(self, record):
+        """
+        Add one record, writing out a chunk whenever chunk_size records have built up.
+        """
+        self.records.append(record)
+
+        if len(self.records) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the records held so far to the next chunk file.
+        """
+        if not self.records:
+            return
+
+        path = os.path.join(self.directory, f'part-{len(self.paths):05d}.{self.file_format}')
+        temp_path = path + '.tmp'
+
+        if self.file_format == 'parquet':
+            pd.DataFrame(self.records).to_parquet(temp_path, index = False)
+        else:
+            with open(temp_path, 'w') as f:
+                for record in self.records:
+                    f.write(json.dumps(record) + '\n')
+
+        #Renaming is atomic, so readers never see a half written chunk
+        os.replace(temp_path, path)
+
+        self.paths.append(path)
+        self.records = []
+
+    def close(self):
+        """
+        Write the last chunk and mark the output as complete.
+        """
+        self.flush()
+        open(os.path.join(self.directory, 'done'), 'w').close()
+
+    def __enter__(self):
+        return self
+
+    def fail(self, error):
+        """
+        Write the last chunk and mark the output as failed, with the error that stopped the crawl.
+        """
+        self.flush()
+
+        with open(os.path.join(self.directory, 'failed'), 'w') as f:
+            f.write(repr(error))
+
+    def __exit__(self, *exc_info):
+        #Only mark the output complete when the crawl finished cleanly
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.fail(exc_info[1])
+
+
+def iter_acquire_data(genre_list = genres, cache = None, journal = None, workers = 1, max_rate = None,
+                      extractor = 'soup'):
+    """
+    This function is the generator version of acquire_data. It takes the same parameters, and yields
+    each book's genre, sub-genre, and original description as a dictionary as soon as the book is done.
+    Only the book urls are held in memory, never the blurbs.
     """
+    #Every request of the crawl shares one pooled session and one rate limit
+    session = make_session(max(workers, 1))
+    limiter = RateLimiter(max_rate)
 
     #Get all sub-genre URLs
-    sub_genres = get_sub_genre_urls(genre_list)
+    sub_genres = get_sub_genre_urls(genre_list, cache = cache, extractor = extractor, workers = workers,
+                                    session = session, limiter = limiter)
 
     #Get all book URLs for each sub-genre
-    book_urls = get_book_urls(sub_genres)
+    book_urls = get_book_urls(sub_genres, cache = cache, journal = journal, workers = workers, session = session,
+                              extractor = extractor, limiter = limiter)
 
     #Convert to data frame
     url_df = pd.DataFrame(book_urls)
@@ -267,47 +1003,200 @@ def acquire_data(genre_list = genres):
     #Drop duplicate entries
     url_df = url_df.drop_duplicates(subset = ['url'])
 
-    #Now create separate dfs for each genre
-    horror_df = book_urls[url_df.genre == 'Horror']
-    romance_df = book_urls[url_df.genre == 'Romance']
-    mystery_df = book_urls[url_df.genre == 'Mystery and Crime']
-    fantasy_df = book_urls[url_df.genre == 'Sci-Fi and Fantasy']
+    #Now retrieve all the individual book blurbs. The journal checkpoints every book,
+    #so all genres can be gathered in one call without risking hours of work
+    yield from iter_book_blurbs(url_df.to_dict('records'), workers = workers, session = session,
+                                cache = cache, journal = journal, extractor = extractor, limiter = limiter)
+
+
+def acquire_to_chunks(directory, chunk_size = 1000, file_format = 'jsonl', **kwargs):
+    """
+    This function runs the whole crawl like acquire_data, but writes the records to chunk files in
+    directory as they arrive instead of building one dataframe. The chunks can be prepared with
+    prepare.prepare_chunks while the crawl is still running. Any other keyword arguments are passed
+    on to iter_acquire_data.
+
+    Returns the list of chunk file paths that were written.
+    """
+    with ChunkWriter(directory, chunk_size = chunk_size, file_format = file_format) as writer:
+        for record in iter_acquire_data(**kwargs):
+            writer.write(record)
+
+    return writer.paths
+
+
+def iter_listed_books(sub_genres, index, cache = None, extractor = 'soup', stop_early = True, workers = 1, max_rate = None,
+                      session = None, limiter = None):
+    """
+    This function walks the listing pages of every sub-genre, like get_book_urls, and yields the
+    dictionary of every book it finds, in (sub-genre, page) order. With stop_early = True it stops
+    walking a sub-genre as soon as a page holds nothing but books already in the index. Books
+    already in the index are marked as seen.
+
+    The sub-genres are walked side by side: page i of every sub-genre that is still going is
+    requested in one round through fetch_all, which takes workers, max_rate, session, and limiter.
+    """
+    if session is None:
+        session = make_session(max(workers, 1))
+
+    if limiter is None:
+        limiter = RateLimiter(max_rate)
+
+    #Map each (sub-genre position, page number) to the books found on that page
+    page_books = {}
+
+    #The last page of every sub-genre still being walked, and the page to request next
+    last_pages = {n: 1 for n in range(len(sub_genres))}
+    i = 1
+
+    while last_pages:
+        pages = [(n, sub_genres[n]['url'] if i == 1 else sub_genres[n]['url'] + '?Nrpp=20&page=' + str(i))
+                 for n in last_pages if i <= last_pages[n]]
+
+        responses = fetch_all([url for n, url in pages], workers = workers, session = session, cache = cache,
+                              limiter = limiter)
+
+        for (n, url), response in zip(pages, responses):
+            sub_genre = sub_genres[n]
+
+            if response.status_code != 200:
+                metrics.event('listing_page_failed', f'Something went wrong at page {i} of {sub_genre["genre"]}, {sub_genre["sub-genre"]}! Status Code: {response.status_code}',
+                              genre = sub_genre['genre'], sub_genre = sub_genre['sub-genre'], page = i,
+                              status = response.status_code)
+                del last_pages[n]
+                continue
+
+            with metrics.timer('parse_seconds', page = 'listing'):
+                links, page_count = extractors[extractor].listing_page(response.content, last_page = i == 1)
+            books = get_page_books(links, sub_genre)
+
+            if i == 1:
+                last_pages[n] = page_count
+
+            known = index.known([book['url'] for book in books])
+            index.touch(known)
+
+            page_books[(n, i)] = books
+
+            #The rest of the sub-genre has already been crawled
+            if stop_early and len(known) == len(books):
+                metrics.event('listing_stopped', f'Stopped {sub_genre["genre"]}, {sub_genre["sub-genre"]} at page {i} of {last_pages[n]}: nothing new.',
+                              genre = sub_genre['genre'], sub_genre = sub_genre['sub-genre'], page = i)
+                del last_pages[n]
 
-    #Convert to a dict for ease of use in the function
-    horror_urls = horror_df.to_dict('records')
-    romance_urls = romance_df.to_dict('records')
-    mystery_urls = mystery_df.to_dict('records')
-    fantasy_urls = fantasy_df.to_dict('records')
+        #Drop the sub-genres whose last page has been read
+        last_pages = {n: last_page for n, last_page in last_pages.items() if i < last_page}
+        i += 1
 
-    #Now retrieve all the individual book blurbs
-    #Since doing them all at the same time is proving to be difficult,
-    #Set up a series of function calls to get the blurbs one overall genre at a time
+    for key in sorted(page_books):
+        yield from page_books[key]
 
-    #For the Horror Section:
-    horror_blurbs = get_book_blurbs(horror_urls)
 
-    #For the romance section
-    romance_blurbs = get_book_blurbs(romance_urls)
+def iter_incremental_data(index, genre_list = genres, cache = None, workers = 1, max_rate = None,
+                          extractor = 'soup', stop_early = True, recheck = False):
+    """
+    This function re-crawls the site against a CrawlIndex from earlier crawls and yields the records
+    (genre, sub-genre, and blurb) of books that are new, or that have changed since they were indexed.
+    Only new books are fetched, unless recheck = True, in which case every listed book is fetched again
+    and compared by its blurb's fingerprint. Pass a ResponseCache to make those rechecks cheap
+    conditional requests. Books whose fetch fails are recorded in the index with their status code
+    (see CrawlIndex.record_failure), so they are not fetched again until a recheck. stop_early is
+    passed on to iter_listed_books. The other parameters work as they do in acquire_data.
+    """
+    #Start the timer
+    time_start = time.perf_counter()
+
+    #Every request of the crawl shares one pooled session and one rate limit
+    session = make_session(max(workers, 1))
+    limiter = RateLimiter(max_rate)
+
+    #Get all sub-genre URLs, then every listed book that needs fetching
+    sub_genres = get_sub_genre_urls(genre_list, cache = cache, extractor = extractor, workers = workers,
+                                    session = session, limiter = limiter)
+
+    listed = pd.DataFrame(list(iter_listed_books(sub_genres, index, cache = cache, extractor = extractor,
+                                                 stop_early = stop_early, workers = workers, session = session,
+                                                 limiter = limiter)))
+
+    #Drop duplicate entries
+    listed = listed.drop_duplicates(subset = ['url']).to_dict('records') if len(listed) else []
+
+    if not recheck:
+        known = index.known([book['url'] for book in listed])
+        listed = [book for book in listed if book['url'] not in known]
+
+    metrics.event('books_to_fetch', f'Books to fetch: {len(listed)}', books = len(listed))
+
+    #Keep count of what happened to each book
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'failed': 0}
+
+    responses = fetch_all([book['url'] for book in listed], workers = workers, session = session, cache = cache,
+                          limiter = limiter)
+
+    for book, response in zip(listed, responses):
+        #Check the status code. If there is a problem, leave a message
+        if response.status_code != 200:
+            index.record_failure(book, response.status_code)
+            counts['failed'] += 1
+            metrics.count('books', result = 'failed')
+            metrics.event('book_failed', f'Something went wrong at book url {book["url"]}! Status Code: {response.status_code}',
+                          url = book['url'], status = response.status_code)
+            continue
+
+        #Get the description and remove leading and trailing whitespace and '\xa0'
+        with metrics.timer('parse_seconds', page = 'book'):
+            blurb = extractors[extractor].blurb(response.content)
 
-    #For the mystery and crime section
-    mystery_blurbs = get_book_blurbs(mystery_urls)
+        if blurb is not None:
+            blurb = blurb.strip().replace('\xa0 ', '')
 
-    #Before continuing, remove a certain entry from the mystery section that was giving me trouble.
-    mystery_blurbs = mystery_blurbs.drop(mystery_blurbs.index[558])
+        status = index.record(book, blurb)
+        counts[status] += 1
+        metrics.count('books', result = status)
 
-    #For the Sci-Fi and Fantasy section
-    fantasy_blurbs = get_book_blurbs(fantasy_urls)
+        if status != 'unchanged' and blurb is not None:
+            yield {'genre': book['genre'],
+                   'sub-genre': book['sub-genre'],
+                   'blurb': blurb}
 
-    #Now that all the data has been acquired, create a new list to hold all entries
-    book_blurbs = []
+    elapsed = time.perf_counter() - time_start
 
-    #Now extend book_blurbs with all the data
-    book_blurbs.extend(horror_blurbs)
-    book_blurbs.extend(romance_blurbs)
-    book_blurbs.extend(mystery_blurbs)
-    book_blurbs.extend(fantasy_blurbs)
+    metrics.event('complete', f'Incremental Crawl Complete! Total Time: {elapsed / 60} minutes\n'
+                              f'New: {counts["new"]}, Changed: {counts["changed"]}, Unchanged: {counts["unchanged"]}, '
+                              f'Failed: {counts["failed"]}',
+                  seconds = elapsed, **counts)
+
+
+def acquire_incremental(index, **kwargs):
+    """
+    This function runs iter_incremental_data and returns the new and changed books as a dataframe.
+    The full, updated corpus is available afterwards from index.to_frame().
+    """
+    return pd.DataFrame(list(iter_incremental_data(index, **kwargs)), columns = ['genre', 'sub-genre', 'blurb'])
+
+
+def acquire_data(genre_list = genres, cache = None, journal = None, workers = 1, max_rate = None, extractor = 'soup'):
+    """
+    This function puts all of the above functions together and allows the user to gather all of the data with just one function call.
+
+    Parameters:
+        genre_list: The initial list of overall genre URL's.
+        cache: An optional ResponseCache shared by every request, so reruns are served from disk.
+        journal: An optional CrawlJournal. Listing pages and books recorded in it by an earlier,
+                 interrupted run are not fetched again, so a restarted crawl resumes where it stopped.
+        workers: The number of listing and book pages to fetch concurrently.
+        max_rate: The maximum number of requests per second to send to the site.
+        extractor: The name of the extractors.py backend used to parse the pages.
+
+    Returns:
+        A dataframe containing each book's genre, sub-genre, and original description.
+    """
+
+    #Gather every book's record
+    book_blurbs = list(iter_acquire_data(genre_list, cache = cache, journal = journal, workers = workers,
+                                         max_rate = max_rate, extractor = extractor))
 
     #Now that the data is all in one list, convert it to a df
     book_blurbs = pd.DataFrame(book_blurbs)
 
-    return book_blurbs
\ No newline at end of file
+    return book_blurbs
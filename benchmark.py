@@ -0,0 +1,486 @@
+import os
+import sys
+import glob
+import time
+import json
+import platform
+import argparse
+import threading
+from datetime import datetime, timezone
+from importlib import metadata
+import numpy as np
+import pandas as pd
+import nltk
+import nltk.sentiment
+from extractors import extractors
+import prepare
+import nlp_resources
+
+#The saved pages used by the benchmarks live next to this file
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def extract(backend, name, content):
+    """
+    This function runs the extraction acquire.py would run on a saved page, picking the
+    method from the fixture's file name, and returns what the backend found.
+    """
+    if name.startswith('genre_page'):
+        return backend.sub_genre_links(content)
+
+    if name.startswith('listing_page'):
+        return backend.listing_page(content, last_page = True)
+
+    return backend.blurb(content)
+
+
+def load_fixtures(directory = fixture_dir):
+    """
+    This function reads every saved html page in the directory and returns a list of
+    (file name, raw bytes) tuples.
+    """
+    fixtures = []
+
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, 'rb') as f:
+            fixtures.append((os.path.basename(path), f.read()))
+
+    return fixtures
+
+
+def benchmark_extractors(directory = fixture_dir, repeat = 20, backends = None):
+    """
+    This function times every extractor backend on every saved page and checks that each
+    backend returns exactly what the 'soup' backend returns.
+
+    It returns a dataframe with one row per backend and page, holding the pages parsed per
+    second and whether the output matched.
+    """
+    if backends is None:
+        backends = list(extractors)
+
+    rows = []
+
+    for name, content in load_fixtures(directory):
+        #The original BeautifulSoup code is the reference every backend must match
+        expected = extract(extractors['soup'], name, content)
+
+        for backend in backends:
+            result = extract(extractors[backend], name, content)
+
+            time_start = time.perf_counter()
+            for i in range(repeat):
+                extract(extractors[backend], name, content)
+            seconds = time.perf_counter() - time_start
+
+            rows.append({'backend': backend,
+                         'fixture': name,
+                         'pages_per_sec': round(repeat / seconds, 1),
+                         'matches': result == expected})
+
+    return pd.DataFrame(rows)
+
+
+def explore_by_row(df):
+    """
+    This function builds the exploration features the way prep_for_exploration used to, with
+    one .apply of a per-row helper for each column and a new VADER analyzer for every row. It is
+    the reference the FeatureEngine is timed and checked against.
+    """
+    df['lem_char_count'] = df.lemmatized.apply(prepare.get_char_count)
+    df['lem_word_count'] = df.lemmatized.apply(prepare.get_word_count)
+    df['lem_unique_word_count'] = df.lemmatized.apply(prepare.get_unique_words)
+    df['sentence_count'] = df.original.apply(prepare.get_sentence_count)
+    df['avg_words_per_sentence'] = round(df.lem_word_count / df.sentence_count).astype(int)
+    df['sentiment'] = df.original.apply(lambda string: nltk.sentiment.SentimentIntensityAnalyzer().polarity_scores(string)['compound'])
+    df['stopword_count'] = df.original.apply(prepare.get_stopword_count)
+    df['word_stopword_ratio'] = round(df.stopword_count / df.lem_word_count, 2)
+
+    return df
+
+
+def benchmark_features(df):
+    """
+    This function times the per-row exploration features against prep_for_exploration on a
+    dataframe of prepared blurbs (with original and lemmatized columns), and checks that both
+    give the same numbers.
+
+    It returns a dataframe with the rows per second of each method and whether they matched.
+    """
+    df = df[['original', 'lemmatized']]
+
+    time_start = time.perf_counter()
+    expected = explore_by_row(df.copy())
+    by_row = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    result = prepare.prep_for_exploration(df.copy())
+    engine = time.perf_counter() - time_start
+
+    matches = result.equals(expected)
+
+    return pd.DataFrame([{'method': 'per-row helpers', 'rows_per_sec': round(len(df) / by_row, 1), 'matches': True},
+                         {'method': 'FeatureEngine', 'rows_per_sec': round(len(df) / engine, 1), 'matches': matches}])
+
+
+def check_near_duplicates(df):
+    """
+    This function checks that drop_near_duplicates works by position on a df of prepared blurbs.
+    df is stacked on a copy of itself, as pd.concat(prepare_chunks(...)) stacks chunks, so every
+    index label appears twice and every blurb has an exact copy. Exactly the rows
+    drop_near_duplicates keeps from df alone should survive.
+    """
+    kept = prepare.drop_near_duplicates(pd.concat([df, df]))
+
+    return kept.equals(prepare.drop_near_duplicates(df))
+
+
+#The words the synthetic blurbs are made of. Every genre has its own words, and the common words
+#include stop words, plurals, and verb forms so every stage of prepare has real work to do.
+genre_words = {'Horror': 'ghost ghosts haunted blood terror demon demons grave graves nightmare nightmares scream '
+                         'screaming darkness corpse corpses curse cursed evil possessed ritual cellar',
+               'Romance': 'love loved kiss kisses heart hearts passion wedding weddings desire lover lovers romance '
+                          'bride brides charming duke duchess billionaire rancher',
+               'Mystery and Crime': 'detective detectives murder murders murdered clue clues suspect suspects crime '
+                                    'crimes police secret secrets alibi victim victims evidence inspector',
+               'Sci-Fi and Fantasy': 'planet planets galaxy galaxies robot robots alien aliens starship empire '
+                                     'empires magic dragon dragons wizard wizards kingdom quest sorcery'}
+
+common_words = ('the a an of in to and was is she he they her his their when after before while city cities town '
+                'family families friend friends year years life lives story stories must find finds found new old '
+                'young dark world worlds house houses night nights day days death truth journey war wars power '
+                'people woman women man men child children wolf wolves running ran never everything nothing '
+                "can't won't isn't she's it's caf\u00e9 na\u00efve \u2014 1987 20th two three first last only "
+                'until against between into through over under again further then once here there all any both '
+                'each few more most other some such no nor not own same so than too very will just').split()
+
+#The share of each genre among the synthetic blurbs
+genre_shares = {'Horror': 0.3, 'Romance': 0.2, 'Mystery and Crime': 0.2, 'Sci-Fi and Fantasy': 0.3}
+
+
+def generate_blurbs(n, seed = 123):
+    """
+    This function returns a dataframe of n synthetic book blurbs with a genre and an original
+    column, like the acquired data. The blurbs are split into sentences, with commas, capitals, and
+    unicode characters, and about one word in seven comes from the genre's own words.
+
+    The same seed always gives the same blurbs, and a smaller n gives the first blurbs of a larger
+    one. Blurbs are made a thousand at a time, so millions of them can be generated.
+    """
+    chunk_size = 1000
+
+    genres = list(genre_words)
+    words = common_words + [word for genre in genres for word in genre_words[genre].split()]
+
+    #Every word in four forms: as is, ending a sentence, before a comma, and starting a sentence
+    forms = np.array(words + [word + '.' for word in words] + [word + ',' for word in words]
+                     + [word.capitalize() for word in words], dtype = object)
+
+    #Where each genre's own words start and end in words
+    bounds = np.cumsum([len(common_words)] + [len(genre_words[genre].split()) for genre in genres])
+
+    chunks = []
+
+    for k, start in enumerate(range(0, n, chunk_size)):
+        #Each chunk gets its own stream of random numbers and is always made whole, so it does not depend on n
+        rng = np.random.default_rng([seed, k])
+        size = chunk_size
+
+        labels = rng.choice(len(genres), size = size, p = [genre_shares[genre] for genre in genres])
+        lengths = rng.integers(20, 200, size = size)
+        total = lengths.sum()
+        docs = np.repeat(np.arange(size), lengths)
+
+        ids = rng.integers(0, len(common_words), size = total)
+        own = rng.random(total) < 0.15
+        low, high = bounds[labels[docs]], bounds[labels[docs] + 1]
+        ids[own] = (low + (rng.random(total) * (high - low)).astype(np.int64))[own]
+
+        #End sentences about every twelve words and at the end of every blurb, then capitalize what follows
+        ends = np.cumsum(lengths)
+        last = np.zeros(total, dtype = bool)
+        last[ends - 1] = True
+        sentence_end = (rng.random(total) < 1 / 12) | last
+        comma = ~sentence_end & (rng.random(total) < 1 / 15)
+        first = np.concatenate([[True], sentence_end[:-1]])
+
+        form = np.where(sentence_end, 1, np.where(comma, 2, np.where(first, 3, 0)))
+        tokens = forms[ids + form * len(words)]
+
+        blurbs = [' '.join(tokens[end - length:end]) for end, length in zip(ends.tolist(), lengths.tolist())]
+        chunks.append(pd.DataFrame({'genre': np.array(genres)[labels], 'original': blurbs}))
+
+    if not chunks:
+        return pd.DataFrame({'genre': pd.Series(dtype = object), 'original': pd.Series(dtype = object)})
+
+    return pd.concat(chunks, ignore_index = True).iloc[:n]
+
+
+def current_rss():
+    """
+    This function returns the resident memory of this process in megabytes, or None where
+    /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+class MemorySampler:
+    """
+    This class records the peak resident memory of the process while a stage runs, by checking it
+    every interval seconds in a background thread. Where /proc is not available it falls back to
+    the peak of the whole process so far.
+    """
+
+    def __init__(self, interval = 0.005):
+        self.interval = interval
+        self.peak = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+
+    def run(self):
+        while True:
+            rss = current_rss()
+
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+            if self.done.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self.thread.start()
+
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+
+        if self.peak is None:
+            import resource
+
+            #ru_maxrss is in kilobytes on Linux and bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def benchmark_stages(n, seed = 123, per_row_limit = 10000, explore_limit = 100000, model_limit = 100000):
+    """
+    This function generates n synthetic blurbs and times every stage of the pipeline on them:
+    - the per-row helpers basic_clean, tokenize, stem, lemmatize, and remove_stopwords, chained as
+      the notebooks ran them, on the first per_row_limit blurbs
+    - prepare_articles on all of them
+    - each exploration feature helper, and prep_for_exploration, on the first explore_limit (but
+      get_stopword_count, which reloads the stop word list for every word, on at most 200)
+    - find_near_duplicates
+    - tokenizing, every vectorization in model.feature_sets, and hashing. Each feature set is also
+      timed with the CountVectorizer or TfidfVectorizer the notebooks used, as <name>_sklearn, as a
+      baseline for TokenCorpus
+    - fitting MultinomialNB and a random forest on the first model_limit
+
+    It returns a list of dictionaries, one per stage, with the rows it ran on, the seconds it took,
+    its rows per second, and the peak resident memory while it ran, in megabytes.
+    """
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+    import model
+
+    df = generate_blurbs(n, seed)
+    results = []
+
+    def run(stage, group, func, data, rows = None):
+        with MemorySampler() as memory:
+            time_start = time.perf_counter()
+            output = func(data)
+            seconds = time.perf_counter() - time_start
+
+        rows = len(data) if rows is None else rows
+
+        results.append({'stage': stage, 'group': group, 'n': n, 'rows': rows, 'seconds': round(seconds, 4),
+                        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+                        'peak_rss_mb': round(memory.peak, 1)})
+
+        return output
+
+    #The original helpers, one row at a time
+    sample = df.original.iloc[:per_row_limit]
+    cleaned = run('basic_clean', 'prepare', lambda data: data.apply(prepare.basic_clean), sample)
+    tokenized = run('tokenize', 'prepare', lambda data: data.apply(prepare.tokenize), cleaned)
+    run('stem', 'prepare', lambda data: data.apply(prepare.stem), tokenized)
+    lemmatized = run('lemmatize', 'prepare', lambda data: data.apply(prepare.lemmatize), tokenized)
+    run('remove_stopwords', 'prepare', lambda data: data.apply(prepare.remove_stopwords), lemmatized)
+
+    prepared = run('prepare_articles', 'prepare', lambda data: prepare.prepare_articles(data.copy(), 'original'), df)
+
+    #Each exploration feature on its own, then all of them together
+    explore = prepared.iloc[:explore_limit]
+
+    for stage, column in [('get_char_count', 'lemmatized'), ('get_word_count', 'lemmatized'),
+                          ('get_unique_words', 'lemmatized'), ('get_sentence_count', 'original'),
+                          ('get_stopword_count', 'original'), ('get_sentiment_compound', 'original')]:
+        data = explore[column].iloc[:200] if stage == 'get_stopword_count' else explore[column]
+
+        #Start the sentiment scorer from scratch, so no score is already cached
+        prepare.default_scorer = None
+        run(stage, 'explore', lambda data, func = getattr(prepare, stage): data.apply(func), data)
+
+    run('prep_for_exploration', 'explore', lambda data: prepare.prep_for_exploration(data.copy()), explore)
+
+    run('find_near_duplicates', 'dedupe', lambda data: prepare.find_near_duplicates(data), prepared)
+
+    #Vectorize the lemmatized blurbs
+    corpus = run('TokenCorpus.from_texts', 'vectorize', prepare.TokenCorpus.from_texts, prepared.lemmatized)
+
+    #Every feature set model.search_feature_sets can build
+    for name, (kind, ngram_range) in model.feature_sets.items():
+
+        #Start from a fresh corpus each time, so no n-grams are shared between feature sets
+        fresh = prepare.TokenCorpus(corpus.vocab, corpus.ids, corpus.offsets)
+        func = fresh.tfidf if kind == 'tfidf' else fresh.counts
+        run(name, 'vectorize', lambda data, func = func, ngram_range = ngram_range: func(ngram_range), fresh, rows = len(fresh))
+
+        #The same features built the way model_data.ipynb built them
+        vectorizer = TfidfVectorizer if kind == 'tfidf' else CountVectorizer
+        run(name + '_sklearn', 'vectorize', vectorizer(ngram_range = ngram_range).fit_transform, prepared.lemmatized)
+
+    run('hashing_vectorizer', 'vectorize', model.hashing_vectorizer().transform, prepared.lemmatized)
+
+    #Fit the models on bag of words features
+    X = corpus.counts()[0][:model_limit]
+    y = prepared.genre.to_numpy()[:model_limit]
+
+    run('fit_multinomial_nb', 'model', lambda data: MultinomialNB().fit(data, y), X, rows = X.shape[0])
+    run('fit_random_forest', 'model', lambda data: RandomForestClassifier(n_estimators = 20, max_depth = 25, random_state = 123).fit(data, y),
+        X, rows = X.shape[0])
+
+    return results
+
+
+def scaling_exponents(stages):
+    """
+    This function takes in the stage results of several sizes and returns, for every stage timed on
+    at least two different numbers of rows, the slope of log(seconds) against log(rows). A stage
+    that grows linearly has a slope near 1.
+    """
+    frame = pd.DataFrame(stages)
+    exponents = {}
+
+    for stage, group in frame.groupby('stage', sort = False):
+        group = group[group.seconds > 0].drop_duplicates('rows')
+
+        if len(group) > 1:
+            exponents[stage] = round(float(np.polyfit(np.log(group.rows), np.log(group.seconds), 1)[0]), 3)
+
+    return exponents
+
+
+def run_suite(sizes = (1000, 10000), seed = 123, per_row_limit = 10000, explore_limit = 100000, model_limit = 100000):
+    """
+    This function runs benchmark_stages at every size and benchmark_extractors on the saved
+    fixtures, and returns a report that can be saved as JSON: the machine and library versions,
+    every stage result, the scaling exponent of every stage, and the extractor results.
+    """
+    stages = []
+
+    for n in sizes:
+        stages.extend(benchmark_stages(n, seed, per_row_limit, explore_limit, model_limit))
+
+    versions = {}
+
+    for package in ['numpy', 'pandas', 'scipy', 'scikit-learn', 'nltk']:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {'meta': {'created': datetime.now(timezone.utc).isoformat(timespec = 'seconds'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(),
+                     'versions': versions,
+                     'nlp_bundle': nlp_resources.load() is not None,
+                     'seed': seed,
+                     'sizes': list(sizes)},
+            'stages': stages,
+            'scaling': scaling_exponents(stages),
+            'extractors': benchmark_extractors().to_dict('records')}
+
+
+def compare_to_baseline(report, baseline, tolerance = 0.25):
+    """
+    This function compares the stages of a report from run_suite with a baseline report, matching
+    them by stage and number of blurbs. A stage has regressed if its rows per second fell by more
+    than tolerance (a share) or its peak memory grew by more than tolerance.
+
+    It returns a dataframe of every matched stage with its baseline and current numbers, its
+    relative change in speed, and whether it regressed.
+    """
+    current = pd.DataFrame(report['stages'])
+    base = pd.DataFrame(baseline['stages'])
+
+    merged = current.merge(base, on = ['stage', 'n'], suffixes = ('', '_baseline'))
+
+    merged['speed_change'] = (merged.rows_per_sec / merged.rows_per_sec_baseline - 1).round(3)
+    merged['memory_change'] = (merged.peak_rss_mb / merged.peak_rss_mb_baseline - 1).round(3)
+    merged['regressed'] = (merged.speed_change < -tolerance) | (merged.memory_change > tolerance)
+
+    return merged[['stage', 'n', 'rows_per_sec_baseline', 'rows_per_sec', 'speed_change',
+                   'peak_rss_mb_baseline', 'peak_rss_mb', 'memory_change', 'regressed']]
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = 'Time every stage of the book blurb pipeline on synthetic blurbs.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [1000, 10000], help = 'numbers of blurbs to generate')
+    parser.add_argument('--seed', type = int, default = 123)
+    parser.add_argument('--per-row-limit', type = int, default = 10000, help = 'blurbs for the per-row helpers')
+    parser.add_argument('--explore-limit', type = int, default = 100000, help = 'blurbs for the exploration features')
+    parser.add_argument('--model-limit', type = int, default = 100000, help = 'blurbs for model fitting')
+    parser.add_argument('--output', default = 'benchmark_results.json', help = 'where to write the JSON report')
+    parser.add_argument('--baseline', help = 'a saved report to compare against')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'allowed slowdown or memory growth, as a share')
+    args = parser.parse_args(args)
+
+    #Check every backend and the feature engine give the reference results before timing anything
+    extractor_results = benchmark_extractors()
+
+    if not extractor_results.matches.all():
+        raise SystemExit('Some extractor backends did not match the soup backend!')
+
+    prepared = prepare.prepare_articles(generate_blurbs(500, args.seed), 'original')
+    features = benchmark_features(prepared)
+
+    if not features.matches.all():
+        raise SystemExit('The feature engine did not match the per-row helpers!')
+
+    if not check_near_duplicates(prepared):
+        raise SystemExit('drop_near_duplicates did not drop the copies of a df with repeated index labels!')
+
+    report = run_suite(args.sizes, args.seed, args.per_row_limit, args.explore_limit, args.model_limit)
+
+    with open(args.output + '.tmp', 'w') as f:
+        json.dump(report, f, indent = 1)
+
+    os.replace(args.output + '.tmp', args.output)
+
+    stages = pd.DataFrame(report['stages'])
+    print(stages.to_string(index = False))
+    print('Scaling exponents:', report['scaling'])
+    print(f'Saved the report to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparison = compare_to_baseline(report, json.load(f), args.tolerance)
+
+        print(comparison.to_string(index = False))
+
+        if comparison.regressed.any():
+            raise SystemExit(f'{comparison.regressed.sum()} stages regressed against {args.baseline}!')
+
+
+if __name__ == '__main__':
+    main()
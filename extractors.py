@@ -0,0 +1,499 @@
+import re
+import warnings
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+from bs4.builder import HTMLParserTreeBuilder
+
+#The stream backend is built on BeautifulSoup's private html.parser subclass, which is not
+#part of its API. If a bs4 release moves or changes it, the stream backend is replaced by soup.
+try:
+    from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+    BeautifulSoupHTMLParser._dereference_numeric_character_reference
+    stream_supported = True
+except (ImportError, AttributeError):
+    BeautifulSoupHTMLParser = HTMLParser
+    stream_supported = False
+
+#Each function in acquire.py only needs one element from the page it downloads.
+#The backends below all pull those same elements out of the raw page content:
+#
+#   sub-genre links:  ul#sidebar-section-0 a
+#   pagination:       ul.pagination.search-pagination a
+#   book links:       div.product-shelf-grid a.pImageLink
+#   blurb:            div[itemprop=description]
+#
+#Every backend in extractors returns exactly what the original BeautifulSoup code
+#returned, malformed markup included. benchmark.py checks this against the saved pages
+#in fixtures/ (the *_malformed pages have stray end tags, nested scripts and odd
+#comments) and reports the pages/sec of each backend.
+
+#Where the scanner can jump to, and which elements change how text is read
+special_tag_re = re.compile(r'<!--|<(/?)(script|style|template|pre|textarea|rt|rp)(?=[\s/>])', re.I)
+raw_text_tags = {'script', 'style', '!--'}
+comment_end_re = re.compile(r'--\s*>')
+quoted_re = re.compile(r'"[^"]*"|\'[^\']*\'')
+partial_value_re = re.compile(r'=\s*["\'][^"\']*$')
+tag_name_re = re.compile(r'<([a-zA-Z][^\s/>]*)')
+
+sidebar_marker = re.compile(r'sidebar-section-0')
+shelf_marker = re.compile(r'product-shelf-grid')
+pagination_marker = re.compile(r'search-pagination')
+blurb_marker = re.compile(r'itemprop\s*=\s*["\']?description', re.I)
+
+
+def get_last_page(soup):
+    """
+    This function takes in the content of an html page. It should be the first page for
+    any sub-genre. It will find and return the number corresponding to the last page
+    available for the sub-genre.
+    """
+    #Now, find out how many pages there are in the sub-genre
+    page_list = soup.find('ul', class_ = 'pagination search-pagination')
+
+    #Now gather the anchor tags in the list
+    a_tags = page_list.find_all('a')
+
+    #Since the last anchor tag is for the very next page,
+    #Select the second to last anchor tag. It will have the number associated with
+    #the last page in the sub-genre
+    last_page = int(a_tags[-2].text.split('\n')[2])
+
+    return last_page
+
+
+def class_matches(value, wanted):
+    """
+    This function checks a class attribute value against a class name the way BeautifulSoup's
+    find does. Class holds several values, so it matches on any one of them or on the whole,
+    normalized, value.
+    """
+    if value is None:
+        return False
+
+    classes = value.split()
+
+    return wanted in classes or ' '.join(classes) == wanted
+
+
+def has_class(wanted):
+    """
+    This function returns a matcher for SoupStrainer. SoupStrainer sees the raw class string
+    while the page is being parsed, so a plain class_ = 'name' would miss elements that have
+    more than one class.
+    """
+    return lambda value: class_matches(value, wanted)
+
+
+def last_page_from_text(anchor_texts):
+    """
+    This function takes in the text of every anchor tag in the pagination list and returns
+    the last page number, the same way get_last_page does.
+    """
+    return int(anchor_texts[-2].split('\n')[2])
+
+
+class SoupExtractor:
+    """
+    Parses pages with BeautifulSoup. By default the whole page is parsed with html.parser,
+    exactly as acquire.py always has. With strain = True only the element being looked
+    for is built into a tree, using a SoupStrainer, which skips most of the work on large pages.
+
+    Straining is not exact on malformed pages: the strained tree cannot see the tags opened
+    outside the element, so a stray end tag that should close one of them (and the element
+    with it) is ignored, and text after it is wrongly kept. That is why it is not one of the
+    backends in extractors.
+    """
+
+    def __init__(self, parser = 'html.parser', strain = False):
+        self.parser = parser
+        self.strain = strain
+
+    def parse(self, content, *strainers):
+        """
+        Parse the content, limited to the given strainers when straining is turned on.
+        """
+        if self.strain:
+            return [BeautifulSoup(content, self.parser, parse_only = strainer) for strainer in strainers]
+
+        soup = BeautifulSoup(content, self.parser)
+
+        return [soup for strainer in strainers]
+
+    def sub_genre_links(self, content):
+        """
+        Return the href of every sub-genre link on a genre page.
+        """
+        soup, = self.parse(content, SoupStrainer('ul', id = 'sidebar-section-0'))
+
+        return [link.attrs['href'] for link in soup.find('ul', id = 'sidebar-section-0').find_all('a')]
+
+    def listing_page(self, content, last_page = False):
+        """
+        Return the href of every book on a sub-genre listing page, and the page's last page
+        number when last_page is True (None otherwise).
+        """
+        strainers = [SoupStrainer('div', class_ = has_class('product-shelf-grid'))]
+        if last_page:
+            strainers.append(SoupStrainer('ul', class_ = has_class('pagination search-pagination')))
+
+        soups = self.parse(content, *strainers)
+
+        #Grab the section that contains all of the books on the page
+        book_container = soups[0].find('div', class_ = 'product-shelf-grid')
+        hrefs = [anchor.attrs['href'] for anchor in book_container.find_all('a', class_ = 'pImageLink')]
+
+        return hrefs, get_last_page(soups[1]) if last_page else None
+
+    def blurb(self, content):
+        """
+        Return the raw text of a book page's description, or None if it has none.
+        """
+        soup, = self.parse(content, SoupStrainer('div', itemprop = 'description'))
+
+        blurb = soup.find('div', itemprop = 'description')
+
+        return blurb.text if blurb is not None else None
+
+
+class _StopScan(Exception):
+    pass
+
+
+class _AmbiguousScan(Exception):
+    pass
+
+
+class ElementScanner(BeautifulSoupHTMLParser):
+    """
+    A streaming scanner built on the same HTMLParser subclass BeautifulSoup uses for
+    'html.parser'. It follows BeautifulSoup's rules for the tag stack, entities, whitespace
+    and which strings count as text, but never builds a tree and stops as soon as the element
+    it is looking for has closed.
+
+    When started part way into a page (fast = True) the scanner does not know which tags were
+    opened before it. If the element is closed by one of those tags, it raises _AmbiguousScan
+    so the caller can rescan the whole page.
+    """
+
+    #Strings inside these tags are not part of .text
+    hidden_tags = frozenset(HTMLParserTreeBuilder.DEFAULT_STRING_CONTAINERS)
+
+    #Whitespace-only strings inside these tags are kept as they are
+    preserve_tags = frozenset(HTMLParserTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS)
+
+    void_tags = frozenset(HTMLParserTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS)
+
+    ascii_spaces = '\x20\x0a\x09\x0c\x0d'
+
+    def __init__(self, name, attr, value, anchor_class = None, fast = False):
+        HTMLParser.__init__(self, convert_charrefs = False)
+        self.name = name
+        self.attr = attr
+        self.value = value
+        self.anchor_class = anchor_class
+        self.fast = fast
+
+        #The open tags, as [name, anchor record or None], and where the element starts in it
+        self.stack = []
+        self.start = None
+
+        self.data = []
+        self.strings = []
+        self.anchors = []
+
+        #Void elements opened without a closing slash. A later end tag for one of them is ignored
+        self.already_closed = []
+
+    @staticmethod
+    def attr_matches(name, value, wanted):
+        """
+        Match an attribute value the way BeautifulSoup's find does.
+        """
+        if name == 'class':
+            return class_matches(value, wanted)
+
+        return value == wanted
+
+    def end_data(self, keep = None):
+        """
+        Flush the pending string, as BeautifulSoup's endData does. keep overrides whether
+        the string counts as text (used for CDATA, comments and declarations).
+        """
+        if not self.data:
+            return
+
+        data = ''.join(self.data)
+        self.data = []
+
+        if self.start is None:
+            return
+
+        names = [entry[0] for entry in self.stack]
+
+        if not any(name in self.preserve_tags for name in names):
+            if not data.strip(self.ascii_spaces):
+                data = '\n' if '\n' in data else ' '
+
+        if keep is None:
+            keep = not any(name in self.hidden_tags for name in names)
+
+        if keep:
+            self.strings.append(data)
+            for entry in self.stack:
+                if entry[1] is not None:
+                    entry[1]['text'].append(data)
+
+    def handle_starttag(self, tag, attrs, handle_empty_element = True):
+        self.end_data()
+
+        attr_dict = {key: ('' if value is None else value) for key, value in attrs}
+        anchor = None
+
+        if self.start is None:
+            if tag == self.name and self.attr_matches(self.attr, attr_dict.get(self.attr), self.value):
+                #A fast scan may have stale tags below the element, so it must not rely on them
+                if self.fast and any(entry[0] in self.hidden_tags or entry[0] in self.preserve_tags
+                                     for entry in self.stack):
+                    raise _AmbiguousScan()
+
+                self.start = len(self.stack)
+        elif tag == 'a' and (self.anchor_class is None
+                             or class_matches(attr_dict.get('class'), self.anchor_class)):
+            anchor = {'attrs': attr_dict, 'text': []}
+            self.anchors.append(anchor)
+
+        #Void elements are closed straight away
+        if tag in self.void_tags and handle_empty_element:
+            self.already_closed.append(tag)
+            return
+
+        self.stack.append([tag, anchor])
+
+    def handle_endtag(self, tag, check_already_closed = True):
+        #BeautifulSoup drops the end tag of an already closed void element without
+        #ending the current string
+        if check_already_closed and tag in self.already_closed:
+            self.already_closed.remove(tag)
+            return
+
+        #A fast scan cannot tell whether the void element was opened before it started
+        if self.fast and self.start is not None and check_already_closed and tag in self.void_tags:
+            raise _AmbiguousScan()
+
+        self.end_data()
+
+        #In a fast scan only the tags opened inside the element are known for certain
+        uncertain = self.fast and self.start is not None
+        base = self.start if uncertain else 0
+        names = [entry[0] for entry in self.stack[base:]]
+
+        if tag not in names:
+            #Void elements never stay open, so their end tags have nothing to close.
+            #Any other end tag may close something a fast scan does not know about
+            if uncertain and tag not in self.void_tags:
+                raise _AmbiguousScan()
+            return
+
+        #Pop up to and including the most recent tag with this name
+        depth = base + len(names) - 1 - names[::-1].index(tag)
+        del self.stack[depth:]
+
+        if self.start is not None and depth <= self.start:
+            raise _StopScan()
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_charref(self, name):
+        dereferenced, replacement_added, extra_data = self._dereference_numeric_character_reference(name)
+        self.handle_data(dereferenced)
+        self.handle_data(extra_data)
+
+    def handle_comment(self, data):
+        self.end_data()
+        self.data.append(data)
+        self.end_data(keep = False)
+
+    def handle_decl(self, decl):
+        self.end_data()
+
+    def unknown_decl(self, data):
+        self.end_data()
+        cdata = data.upper().startswith('CDATA[')
+        self.data.append(data[len('CDATA['):] if cdata else data)
+        self.end_data(keep = cdata)
+
+    def handle_pi(self, data):
+        self.end_data()
+
+    def scan(self, text):
+        """
+        Feed text through the scanner. Returns True if the element was found.
+        """
+        try:
+            self.feed(text)
+            self.close()
+        except _StopScan:
+            return True
+
+        #The element ran to the end of the page
+        self.end_data()
+
+        return self.start is not None
+
+
+class StreamExtractor:
+    """
+    Extracts the elements with ElementScanner instead of building a tree. It jumps straight
+    to the first place the element's id or class appears in the page, and only rescans the
+    whole page when that shortcut cannot be trusted.
+    """
+
+    def decode(self, content):
+        """
+        Decode the page the same way BeautifulSoup does.
+        """
+        if isinstance(content, str):
+            return content
+
+        return UnicodeDammit(content, is_html = True).unicode_markup
+
+    @staticmethod
+    def open_special_tags(text, position):
+        """
+        Return the set of special tags (script, style, template, pre, textarea, rt, rp) that
+        may still be open at position. A comment that is still open counts as '!--'.
+        """
+        depth = {}
+
+        #Comments, scripts and styles are skipped whole, since nothing inside them is a tag
+        skipped = None
+        skip_to = 0
+
+        for match in special_tag_re.finditer(text, 0, position):
+            if match.start() < skip_to:
+                continue
+
+            if match.group(0) == '<!--':
+                #html.parser reads a comment that is never closed as text up to the next '>'
+                close = comment_end_re.search(text, match.start() + 4)
+                skipped = '!--'
+                skip_to = close.end() if close else text.find('>', match.start() + 1) + 1 or len(text)
+                continue
+
+            name = match.group(2).lower()
+
+            if name in raw_text_tags and not match.group(1):
+                close = re.compile(r'</\s*%s\s*>' % name, re.I).search(text, match.end())
+                skipped = name
+                skip_to = close.end() if close else len(text)
+            else:
+                depth[name] = max(depth.get(name, 0) + (-1 if match.group(1) else 1), 0)
+
+        if position < skip_to:
+            return {skipped}
+
+        return {name for name in depth if depth[name]}
+
+    def find_start(self, text, marker, name):
+        """
+        Find where a fast scan for a name tag can start. Returns the position of the first
+        marker match that sits inside an opening name tag, -1 if no match can be the element,
+        or None if it cannot be told without scanning the whole page.
+        """
+        for match in marker.finditer(text):
+            start = text.rfind('<', 0, match.start())
+
+            if start == -1:
+                continue
+
+            #Matches inside scripts, styles and comments are not tags
+            special = self.open_special_tags(text, start)
+
+            if special & raw_text_tags:
+                continue
+
+            #Inside the other special tags the text is read differently
+            if special:
+                return None
+
+            #Matches in the page text are not tags either. The marker may sit inside
+            #a quoted attribute value, so drop that value's opening part as well
+            opening = partial_value_re.sub('=', quoted_re.sub('', text[start:match.start()]))
+
+            if '>' in opening:
+                continue
+
+            #A stray quote means the '<' was inside an attribute value
+            if '"' in opening or "'" in opening:
+                return None
+
+            tag = tag_name_re.match(opening)
+
+            if tag is not None and tag.group(1).lower() == name:
+                return start
+
+        return -1
+
+    def scan(self, content, marker, name, attr, value, anchor_class = None):
+        """
+        Scan content for the first name tag whose attr matches value. Returns the finished
+        scanner, or None if there is no such tag. marker is a regular expression that must
+        match inside the tag's opening, which is where the scan starts.
+        """
+        text = self.decode(content)
+
+        start = self.find_start(text, marker, name)
+
+        #Without a usable marker the element cannot be on the page
+        if start == -1:
+            return None
+
+        if start is not None:
+            scanner = ElementScanner(name, attr, value, anchor_class, fast = True)
+            try:
+                return scanner if scanner.scan(text[start:]) else None
+            except _AmbiguousScan:
+                pass
+
+        #Fall back to scanning the whole page
+        scanner = ElementScanner(name, attr, value, anchor_class)
+
+        return scanner if scanner.scan(text) else None
+
+    def sub_genre_links(self, content):
+        scanner = self.scan(content, sidebar_marker, 'ul', 'id', 'sidebar-section-0')
+
+        return [anchor['attrs']['href'] for anchor in scanner.anchors]
+
+    def listing_page(self, content, last_page = False):
+        #Decode once for both scans
+        content = self.decode(content)
+
+        scanner = self.scan(content, shelf_marker, 'div', 'class', 'product-shelf-grid', anchor_class = 'pImageLink')
+        hrefs = [anchor['attrs']['href'] for anchor in scanner.anchors]
+
+        if not last_page:
+            return hrefs, None
+
+        scanner = self.scan(content, pagination_marker, 'ul', 'class', 'pagination search-pagination')
+
+        return hrefs, last_page_from_text([''.join(anchor['text']) for anchor in scanner.anchors])
+
+    def blurb(self, content):
+        scanner = self.scan(content, blurb_marker, 'div', 'itemprop', 'description')
+
+        return ''.join(scanner.strings) if scanner is not None else None
+
+
+#The available backends, by name
+extractors = {
+    'soup': SoupExtractor(),
+    'stream': StreamExtractor(),
+}
+
+if not stream_supported:
+    warnings.warn('This version of bs4 does not have the parser internals the stream extractor needs. '
+                  "Using the 'soup' extractor in its place.")
+    extractors['stream'] = extractors['soup']
+
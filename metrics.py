@@ -0,0 +1,272 @@
+import json
+import time
+import bisect
+import threading
+import contextlib
+import pandas as pd
+
+#Where metrics go. None disables them, which is the default.
+sink = None
+
+#Histogram bucket upper bounds in seconds, from 0.1 milliseconds to about 2 minutes, each 1.5 times the last
+bounds = [1e-4 * 1.5 ** i for i in range(36)]
+
+#The context manager handed out while metrics are disabled. It does nothing.
+null_timer = contextlib.nullcontext()
+
+
+class Histogram:
+    """
+    This class counts observations, such as request latencies, in fixed buckets (see bounds) and
+    keeps their count, sum, minimum and maximum. Quantiles are estimated from the buckets, to within
+    the bucket width, so it takes the same small amount of memory however many values it sees.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Return an estimate of the q quantile: the upper bound of the bucket it falls in, clipped to
+        the range of values seen.
+        """
+        if not self.count:
+            return float('nan')
+
+        rank = q * self.count
+        seen = 0
+
+        for i, n in enumerate(self.buckets):
+            seen += n
+
+            if seen >= rank and n:
+                return max(min(bounds[i] if i < len(bounds) else self.max, self.max), self.min)
+
+        return self.max
+
+
+class MemorySink:
+    """
+    This class keeps metrics in memory: a running total for every counter, a Histogram for every
+    observed value, and the list of events, each kept apart by name and labels. It is safe to share
+    between threads. summary and stages turn it into dataframes.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, record):
+        key = (record['name'], tuple(sorted(record.get('labels', {}).items())))
+
+        with self.lock:
+            if record['kind'] == 'count':
+                self.counters[key] = self.counters.get(key, 0) + record['value']
+            elif record['kind'] == 'observe':
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+
+                self.histograms[key].add(record['value'])
+            else:
+                self.events.append(record)
+
+    def counter(self, name, **labels):
+        """
+        Return the total of a counter, over every label value not given.
+        """
+        return sum(value for (key, key_labels), value in self.counters.items()
+                   if key == name and labels.items() <= dict(key_labels).items())
+
+    def summary(self):
+        """
+        Return a dataframe with one row per counter and histogram. Histogram rows hold the count,
+        total, mean, and the estimated 50th, 90th and 99th percentiles of their values.
+        """
+        rows = []
+
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                rows.append({'name': name, 'labels': dict(labels), 'count': None, 'total': value})
+
+            for (name, labels), histogram in self.histograms.items():
+                rows.append({'name': name, 'labels': dict(labels), 'count': histogram.count, 'total': histogram.sum,
+                             'mean': histogram.sum / histogram.count, 'p50': histogram.quantile(0.5),
+                             'p90': histogram.quantile(0.9), 'p99': histogram.quantile(0.99), 'max': histogram.max})
+
+        return pd.DataFrame(rows, columns = ['name', 'labels', 'count', 'total', 'mean', 'p50', 'p90', 'p99', 'max'])
+
+    def stages(self):
+        """
+        Return a dataframe of the stages timed with stage: how many times each ran, the rows it
+        processed, its total wall time, and its rows per second.
+        """
+        rows = []
+
+        with self.lock:
+            for (name, labels), histogram in self.histograms.items():
+                if name == 'stage_seconds':
+                    stage = dict(labels)['stage']
+                    processed = self.counters.get(('stage_rows', labels), 0)
+
+                    rows.append({'stage': stage, 'calls': histogram.count, 'rows': processed, 'seconds': histogram.sum,
+                                 'rows_per_sec': processed / histogram.sum if histogram.sum else float('nan')})
+
+        return pd.DataFrame(rows, columns = ['stage', 'calls', 'rows', 'seconds', 'rows_per_sec'])
+
+
+class JsonlSink:
+    """
+    This class appends every metric to a file as one JSON object per line, with the time it was
+    recorded, so runs can be kept and aggregated later with load. It is safe to share between
+    threads, and can be used as a context manager that closes the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding = 'utf-8')
+        self.lock = threading.Lock()
+
+    def record(self, record):
+        line = json.dumps(dict(record, time = time.time()), default = str) + '\n'
+
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load(path):
+    """
+    This function reads a file written by a JsonlSink and returns a MemorySink holding its metrics.
+    """
+    memory = MemorySink()
+
+    with open(path, encoding = 'utf-8') as f:
+        for line in f:
+            if line.strip():
+                memory.record(json.loads(line))
+
+    return memory
+
+
+def set_sink(new_sink):
+    """
+    This function sends every metric from now on to new_sink, and returns the previous sink. A sink
+    is any object with a record method that takes a dictionary, such as a MemorySink or a JsonlSink.
+    Pass None to disable metrics.
+    """
+    global sink
+
+    old_sink, sink = sink, new_sink
+
+    return old_sink
+
+
+@contextlib.contextmanager
+def recording(new_sink = None):
+    """
+    This function sends metrics to new_sink (a new MemorySink by default) inside a with block, and
+    yields it.
+    """
+    new_sink = MemorySink() if new_sink is None else new_sink
+    old_sink = set_sink(new_sink)
+
+    try:
+        yield new_sink
+    finally:
+        set_sink(old_sink)
+
+
+def count(name, value = 1, **labels):
+    """
+    This function adds value to the counter called name.
+    """
+    if sink is not None:
+        sink.record({'kind': 'count', 'name': name, 'value': value, 'labels': labels})
+
+
+def observe(name, value, **labels):
+    """
+    This function adds value to the histogram called name.
+    """
+    if sink is not None:
+        sink.record({'kind': 'observe', 'name': name, 'value': value, 'labels': labels})
+
+
+def event(name, message, **fields):
+    """
+    This function records that something happened, such as a skipped book, with a human readable
+    message and any other fields. While metrics are disabled the message is printed instead, so
+    interactive runs show the same progress they always have.
+    """
+    if sink is None:
+        print(message)
+    else:
+        sink.record({'kind': 'event', 'name': name, 'message': message, 'labels': fields})
+
+
+class Timer:
+    """
+    This class is a context manager that observes the wall time of its with block, in seconds,
+    under name. If rows is given, it is also counted under stage_rows, so stages can report
+    rows per second.
+    """
+
+    def __init__(self, name, labels, rows = None):
+        self.name = name
+        self.labels = labels
+        self.rows = rows
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+        if self.rows is not None:
+            count('stage_rows', self.rows, **self.labels)
+
+
+def timer(name, **labels):
+    """
+    This function returns a context manager that observes the time its with block takes under name.
+    It does nothing, and costs next to nothing, while metrics are disabled.
+    """
+    if sink is None:
+        return null_timer
+
+    return Timer(name, labels)
+
+
+def stage(name, rows):
+    """
+    This function returns a context manager that records the wall time of one run of a pipeline
+    stage over rows rows, for MemorySink.stages. It does nothing while metrics are disabled.
+    """
+    if sink is None:
+        return null_timer
+
+    return Timer('stage_seconds', {'stage': name}, rows)
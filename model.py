@@ -0,0 +1,446 @@
+import os
+import hashlib
+import json
+import math
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import rankdata
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import GridSearchCV, ParameterGrid, StratifiedKFold, check_cv
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.neighbors import KNeighborsClassifier, NearestNeighbors
+from sklearn.utils import _safe_indexing
+from sklearn.utils.extmath import safe_sparse_dot
+from prepare import TokenCorpus
+from streaming import feature_sets, hashing_vectorizer, read_prepared_chunks, shuffle_chunks, stream_fit
+
+
+def cv_results_frame(params, scores):
+    """
+    This function takes in the list of parameter dictionaries searched and an array of their
+    scores (one row per parameter dictionary, one column per fold), and returns a dataframe laid
+    out like GridSearchCV's cv_results_, ranked the same way.
+    """
+    results = pd.DataFrame({'params': params})
+
+    for name in sorted({name for p in params for name in p}):
+        results['param_' + name] = [p.get(name) for p in params]
+
+    for k in range(scores.shape[1]):
+        results[f'split{k}_test_score'] = scores[:, k]
+
+    #GridSearchCV averages the fold scores and ranks ties with the lowest rank
+    means = np.average(scores, axis = 1)
+
+    results['mean_test_score'] = means
+    results['std_test_score'] = np.sqrt(np.average((scores - means[:, np.newaxis]) ** 2, axis = 1))
+    results['rank_test_score'] = rankdata(-means, method = 'min').astype(np.int32)
+
+    return results
+
+
+def multinomial_cv_results(X_train, y_train, param_dict, cv = 5, batch_size = 20):
+    """
+    This function scores every combination of alpha and fit_prior in param_dict for a Multinomial
+    Naive Bayes model, over the same cross-validation folds GridSearchCV would use, and returns
+    the results as a cv_results_frame.
+
+    Instead of fitting a model for every combination, it counts the features of each class once
+    per fold, since those counts do not depend on alpha or fit_prior. The log probabilities of
+    batch_size alphas are then scored against the fold's test rows with one matrix product.
+    The scores are identical to GridSearchCV's.
+    """
+    unknown = set(param_dict) - {'alpha', 'fit_prior'}
+
+    if unknown:
+        raise ValueError(f'multinomial_cv_results can only search alpha and fit_prior, not {sorted(unknown)}')
+
+    params = list(ParameterGrid(param_dict))
+    alphas = sorted({p.get('alpha', 1.0) for p in params})
+
+    #Dense products go through BLAS, which only matches a single model's result one alpha at a time
+    if not sparse.issparse(X_train):
+        batch_size = 1
+
+    y_train = np.asarray(y_train)
+    splits = list(check_cv(cv, y_train, classifier = True).split(X_train, y_train))
+    scores = np.empty((len(params), len(splits)))
+
+    for k, (train, test) in enumerate(splits):
+        #One fit gives the per-class feature and class counts of the fold
+        nb = MultinomialNB().fit(_safe_indexing(X_train, train), y_train[train])
+        feature_count = nb.feature_count_
+        class_count = nb.class_count_
+        n_classes = len(nb.classes_)
+
+        #The class log priors, computed as MultinomialNB computes them
+        with np.errstate(divide = 'ignore'):
+            priors = {True: np.log(class_count) - np.log(class_count.sum()),
+                      False: np.full(n_classes, -np.log(n_classes))}
+
+        X_test = _safe_indexing(X_train, test)
+        y_test = y_train[test]
+
+        for i in range(0, len(alphas), batch_size):
+            batch = alphas[i:i + batch_size]
+
+            #Stack the feature log probabilities of every alpha in the batch, one column per class and alpha
+            log_probs = []
+
+            for alpha in batch:
+                smoothed_fc = feature_count + alpha
+                smoothed_cc = smoothed_fc.sum(axis = 1)
+                log_probs.append((np.log(smoothed_fc) - np.log(smoothed_cc.reshape(-1, 1))).T)
+
+            log_likelihood = safe_sparse_dot(X_test, np.concatenate(log_probs, axis = 1))
+
+            for j, alpha in enumerate(batch):
+                block = log_likelihood[:, j * n_classes:(j + 1) * n_classes]
+
+                for p, param in enumerate(params):
+                    if param.get('alpha', 1.0) != alpha:
+                        continue
+
+                    predictions = nb.classes_[np.argmax(block + priors[param.get('fit_prior', True)], axis = 1)]
+
+                    #The accuracy, as the model's score method computes it
+                    scores[p, k] = np.count_nonzero(predictions == y_test) / len(y_test)
+
+    return cv_results_frame(params, scores)
+
+
+def get_multinomial_models(X_train_scaled, y_train, param_dict, cv = 5):
+    """
+    This function will create an optimized Multinomial Naive Bayes classification model. It will
+    use the X_train_scaled and y_train data for fitting. The param_dict contains the alpha and
+    fit_prior values to optimize across. The cv parameter indicates how many folds will be
+    evaluated, and defaults to 5.
+
+    It finds the same best model and mean cross-validated accuracy as GridSearchCV, but scores
+    every combination with multinomial_cv_results instead of fitting each one.
+
+    This function prints out the mean cross-validated accuracy, best paramters, and returns
+    the best model.
+    """
+    results = multinomial_cv_results(X_train_scaled, y_train, param_dict, cv = cv)
+
+    #GridSearchCV picks the first of the best ranked combinations
+    best = results.rank_test_score.argmin()
+    best_params = results.params[best]
+
+    #Print the best model's score and parameters
+    print('Mean Cross-Validated Accuracy: ', round(results.mean_test_score[best], 4))
+    print('Alpha: ', best_params.get('alpha', 1.0))
+    print('Fit Prior: ', best_params.get('fit_prior', True))
+
+    #Refit the best model on all of the training data
+    return MultinomialNB(**best_params).fit(X_train_scaled, y_train)
+
+
+def knn_cv_results(X_train, y_train, param_dict, cv = 5):
+    """
+    This function scores every combination of n_neighbors and weights in param_dict for a KNN
+    classifier, over the same cross-validation folds GridSearchCV would use, and returns the
+    results as a cv_results_frame.
+
+    For each fold the largest number of neighbors searched is found once, and every smaller
+    n_neighbors is scored from the front of those sorted neighbor lists. The neighbors come from
+    the same search KNeighborsClassifier runs (blocked sparse dot products, which for tf-idf rows
+    rank by cosine similarity), so the distances are exactly the ones GridSearchCV sees, and votes
+    are counted as KNeighborsClassifier counts them. The scores match GridSearchCV's, except that
+    when several training rows tie at exactly the k-th distance, as raw counts often do, either
+    search may keep a different one of them. As with GridSearchCV, a combination asking for more
+    neighbors than a fold has training rows scores nan.
+    """
+    unknown = set(param_dict) - {'n_neighbors', 'weights'}
+
+    if unknown:
+        raise ValueError(f'knn_cv_results can only search n_neighbors and weights, not {sorted(unknown)}')
+
+    params = list(ParameterGrid(param_dict))
+
+    y_train = np.asarray(y_train)
+    splits = list(check_cv(cv, y_train, classifier = True).split(X_train, y_train))
+    scores = np.full((len(params), len(splits)), np.nan)
+
+    for f, (train, test) in enumerate(splits):
+        classes, labels = np.unique(y_train[train], return_inverse = True)
+        y_test = y_train[test]
+
+        max_k = min(max(p.get('n_neighbors', 5) for p in params), len(train))
+
+        #Find the nearest max_k training rows of every test row, nearest first
+        neighbors = NearestNeighbors(n_neighbors = max_k).fit(_safe_indexing(X_train, train))
+        distances, indices = neighbors.kneighbors(_safe_indexing(X_train, test))
+        neighbor_labels = labels[indices]
+
+        #Distance weights, with a test row that sits on top of training rows taking only their votes
+        with np.errstate(divide = 'ignore'):
+            weights = 1.0 / distances
+
+        on_top = np.isinf(weights)
+        on_top_rows = on_top.any(axis = 1)
+        weights[on_top_rows] = on_top[on_top_rows]
+
+        for p, param in enumerate(params):
+            k = param.get('n_neighbors', 5)
+
+            if k > len(train):
+                continue
+
+            nearest = neighbor_labels[:, :k]
+
+            if param.get('weights', 'uniform') == 'uniform':
+                votes = np.stack([np.count_nonzero(nearest == c, axis = 1) for c in range(len(classes))], axis = 1)
+            else:
+                #Sum the weights of each class over the same k columns weighted_mode sums over
+                nearest_weights = np.ascontiguousarray(weights[:, :k])
+                votes = np.stack([np.sum(np.where(nearest == c, nearest_weights, 0.0), axis = 1)
+                                  for c in range(len(classes))], axis = 1)
+
+            #Ties go to the first class, as in KNeighborsClassifier
+            predictions = classes[np.argmax(votes, axis = 1)]
+
+            scores[p, f] = np.count_nonzero(predictions == y_test) / len(y_test)
+
+    return cv_results_frame(params, scores)
+
+
+def get_KNN_models(X_train_scaled, y_train, param_dict, cv = 5):
+    """
+    This function takes in scaled data and builds an optimized KNN classification model. 
+    It will use the n_neighbors and weights values specified in the param_dict to optimizie across.
+
+    It finds the same best model and mean cross-validated accuracy as GridSearchCV, but finds
+    each fold's neighbors only once, with knn_cv_results.
+
+    This function returns the best model and prints out its parameters and mean
+    cross-validated accuracy.
+    """
+    results = knn_cv_results(X_train_scaled, y_train, param_dict, cv = cv)
+
+    #GridSearchCV picks the first of the best ranked combinations
+    best = results.rank_test_score.argmin()
+    best_params = results.params[best]
+
+    #Print the best model's score and parameters
+    print('Mean Cross-Validated Accuracy: ', round(results.mean_test_score[best], 4))
+    print('Num Neighbors: ', best_params.get('n_neighbors', 5))
+    print('Weights: ', best_params.get('weights', 'uniform'))
+
+    #Refit the best model on all of the training data
+    return KNeighborsClassifier(**best_params).fit(X_train_scaled, y_train)
+
+
+class FoldCache:
+    """
+    This class gives the cross-validation folds of a set of documents for any of the feature_sets.
+    Each fold's vectorizer is fit on that fold's training documents only, and the fold's test
+    documents are transformed with it, so no test vocabulary leaks into training. All of the
+    documents are tokenized once, and each fold's matrices are saved in directory, so they are
+    built only once and can be reused by every model family and every later run.
+
+    The folds are the same StratifiedKFold splits GridSearchCV makes with cv = cv.
+    """
+
+    def __init__(self, texts, y, cv = 5, directory = 'fold_cache'):
+        self.texts = list(texts)
+        self.y = np.asarray(y)
+        self.splits = list(StratifiedKFold(cv).split(self.texts, self.y))
+        self.corpus = None
+
+        #The cache files belong to these exact documents, labels, and folds
+        key = hashlib.sha1(json.dumps([self.texts, self.y.tolist(), cv]).encode('utf-8')).hexdigest()[:16]
+        self.directory = os.path.join(directory, key)
+
+    def folds(self, feature_set):
+        """
+        Return a list of (X_train, X_test, y_train, y_test) tuples, one per fold, for a feature set.
+        """
+        kind, ngram_range = feature_sets[feature_set]
+        directory = os.path.join(self.directory, feature_set)
+        os.makedirs(directory, exist_ok = True)
+
+        folds = []
+
+        for k, (train, test) in enumerate(self.splits):
+            paths = [os.path.join(directory, f'fold{k}_{part}.npz') for part in ('train', 'test')]
+
+            if all(os.path.exists(path) for path in paths):
+                X_train, X_test = [sparse.load_npz(path) for path in paths]
+            else:
+                #Tokenize every document once, the first time any fold needs building
+                if self.corpus is None:
+                    self.corpus = TokenCorpus.from_texts(self.texts)
+
+                train_corpus = self.corpus.subset(train)
+                test_corpus = self.corpus.subset(test)
+
+                if kind == 'tfidf':
+                    X_train, vocabulary, idf = train_corpus.tfidf(ngram_range)
+                    X_test = test_corpus.tfidf(ngram_range, vocabulary, idf)[0]
+                else:
+                    X_train, vocabulary = train_corpus.counts(ngram_range)
+                    X_test = test_corpus.counts(ngram_range, vocabulary)[0]
+
+                for path, matrix in zip(paths, (X_train, X_test)):
+                    sparse.save_npz(path + '.tmp.npz', matrix)
+                    os.replace(path + '.tmp.npz', path)
+
+            folds.append((X_train, X_test, self.y[train], self.y[test]))
+
+        return folds
+
+
+def fit_and_score(estimator, X_train, y_train, X_test, y_test):
+    """
+    This function fits an estimator and returns its accuracy on the test data.
+    """
+    return estimator.fit(X_train, y_train).score(X_test, y_test)
+
+
+def halving_search(estimator, param_dict, folds, factor = 3, resource = 'n_samples', min_resources = None,
+                   n_jobs = -1, random_state = 123):
+    """
+    This function searches param_dict by successive halving over a list of cached folds. Every
+    candidate is first trained with a small budget of the resource; only the best 1 / factor of
+    them go on to the next round, which gets factor times as much, and so on until the last round
+    gets all of it. Every fit of a round, across candidates and folds, runs in parallel on n_jobs
+    cores. Each round is scored on the folds' full test rows.
+
+    As in HalvingGridSearchCV, the resource is either 'n_samples', a sample of each fold's training
+    rows, or a parameter of the estimator such as 'n_estimators', counted up to its current value.
+    Random forests on wide sparse matrices spend most of each fit on fixed work per tree, so they
+    save far more from fewer trees than from fewer rows.
+
+    It returns a dataframe with the mean test score of every candidate in every round. The best
+    candidate is the top one of the last round.
+    """
+    candidates = list(ParameterGrid(param_dict))
+
+    if resource == 'n_samples':
+        max_resources = min(len(y_train) for X_train, X_test, y_train, y_test in folds)
+    else:
+        max_resources = estimator.get_params()[resource]
+
+    #Enough rounds to narrow the candidates down to about one
+    n_rounds = max(1, math.ceil(math.log(len(candidates), factor))) if factor > 1 else 1
+
+    #Start as small as that allows, but, as HalvingGridSearchCV does, with at least two rows per class per fold
+    if resource == 'n_samples':
+        smallest = 2 * len(folds) * len(np.unique(folds[0][2]))
+    else:
+        smallest = 1
+
+    if min_resources is None:
+        min_resources = max(max_resources // factor ** (n_rounds - 1), smallest)
+
+    #Stop early if the rows run out first; the last round then keeps every remaining candidate
+    if factor > 1:
+        n_rounds = max(1, min(n_rounds, 1 + int(math.log(max_resources / min_resources, factor))))
+
+    #A fixed shuffle of each fold's training rows, so every round's sample contains the last one's
+    rng = np.random.RandomState(random_state)
+    orders = [rng.permutation(len(y_train)) for X_train, X_test, y_train, y_test in folds]
+
+    results = []
+    parallel = Parallel(n_jobs = n_jobs)
+
+    for i in range(n_rounds):
+        n_resources = max_resources if i == n_rounds - 1 else min(min_resources * factor ** i, max_resources)
+
+        if resource == 'n_samples':
+            budget = {}
+            rows = [order[:n_resources] for order in orders]
+        else:
+            budget = {resource: n_resources}
+            rows = [slice(None)] * len(folds)
+
+        scores = parallel(delayed(fit_and_score)(clone(estimator).set_params(**params, **budget),
+                                                 X_train[fold_rows], y_train[fold_rows], X_test, y_test)
+                          for params in candidates
+                          for (X_train, X_test, y_train, y_test), fold_rows in zip(folds, rows))
+
+        scores = np.array(scores).reshape(len(candidates), len(folds))
+
+        for params, candidate_scores in zip(candidates, scores):
+            results.append({'iter': i,
+                            'n_resources': n_resources,
+                            'params': params,
+                            'mean_test_score': np.average(candidate_scores)})
+
+        #Keep the best 1 / factor of the candidates, in their original order
+        n_keep = max(1, math.ceil(len(candidates) / factor))
+        keep = np.sort(np.argsort(-scores.mean(axis = 1), kind = 'stable')[:n_keep])
+        candidates = [candidates[j] for j in keep]
+
+    results = pd.DataFrame(results)
+    last = results[results['iter'] == results['iter'].max()]
+    results['best'] = False
+    results.loc[last.mean_test_score.idxmax(), 'best'] = True
+
+    return results
+
+
+def search_feature_sets(texts, y, param_dict, estimator = None, names = None, cv = 5, cache_dir = 'fold_cache',
+                        factor = 3, resource = None, n_jobs = -1):
+    """
+    This function runs halving_search for an estimator (a RandomForestClassifier with random_state
+    = 123 by default, as in get_random_forest_models) over every feature set in names (all of
+    feature_sets by default), using a FoldCache so each fold is featurized only once. The resource
+    defaults to 'n_estimators' for estimators that have it and 'n_samples' for the rest.
+
+    It returns a dataframe with the best parameters and mean cross-validated accuracy of each
+    feature set, best first.
+    """
+    if estimator is None:
+        estimator = RandomForestClassifier(random_state = 123)
+
+    if resource is None:
+        resource = 'n_estimators' if 'n_estimators' in estimator.get_params() else 'n_samples'
+
+    cache = FoldCache(texts, y, cv = cv, directory = cache_dir)
+    rows = []
+
+    for name in (names or list(feature_sets)):
+        results = halving_search(estimator, param_dict, cache.folds(name), factor = factor, resource = resource,
+                                 n_jobs = n_jobs)
+        best = results[results.best].iloc[0]
+
+        rows.append({'feature_set': name, 'params': best.params, 'mean_test_score': best.mean_test_score})
+
+    return pd.DataFrame(rows).sort_values('mean_test_score', ascending = False, ignore_index = True)
+
+
+def get_random_forest_models(X_train, y_train, param_dict, cv = 5, n_jobs = -1):
+    """
+    This function creates and returns an optimized random forest classification model. It also
+    prints out the best model's mean cross-validated accuracy score and parameters.
+
+    This function takes in the X and y training sets to fit the models.
+
+    This function takes in a dictionary that contains the parameters to be iterated through.
+
+    This function also takes in a value for the number of cross validation folds to do.
+    The cv value defaults to 5. The fits run on n_jobs cores (all of them by default); the
+    results are the same as running them one at a time.
+    """
+    #Create the classifier model
+    clf = RandomForestClassifier(random_state = 123)
+
+    #Create the GridSearchCV object
+    grid = GridSearchCV(clf, param_dict, cv = cv, n_jobs = n_jobs)
+
+    #Fit the GridSearchCV object
+    grid.fit(X_train, y_train)
+
+    #Print the best model's score and parameters
+    print('Mean Cross-Validated Accuracy: ', round(grid.best_score_, 4))
+    print('Max Depth: ', grid.best_params_['max_depth'])
+    print('Min Samples Per Leaf: ', grid.best_params_['min_samples_leaf'])
+
+    #Return the best model
+    return grid.best_estimator_
@@ -0,0 +1,326 @@
+import os
+import re
+import sys
+import json
+import mmap
+import warnings
+from importlib import metadata
+import numpy as np
+
+#The bundle lives next to this file unless NLP_RESOURCES points somewhere else
+default_path = os.environ.get('NLP_RESOURCES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nlp_resources.bin'))
+
+#The first bytes of every bundle. Bump the number whenever the layout changes.
+magic = b'NLPRES01'
+
+#The bundles already opened by this process, by path
+bundles = {}
+
+#The file VADER reads its lexicon from, as SentimentIntensityAnalyzer does by default
+vader_lexicon = 'sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt'
+
+
+def lemma_table(wordnet):
+    """
+    This function returns a dictionary of every word that WordNetLemmatizer().lemmatize (which treats
+    words as nouns) changes, mapped to its lemma. Any word not in it is its own lemma.
+
+    A word can only change if it is a noun exception or if one of WordNet's noun suffix rules turns
+    it into a noun, so the candidates are the exceptions plus every noun with each rule run backwards.
+    Each candidate is lemmatized exactly as WordNet's _morphy does it.
+    """
+    nouns = {lemma for lemma, pos in wordnet._lemma_pos_offset_map.items() if 'n' in pos}
+    exceptions = wordnet._exception_map['n']
+    substitutions = wordnet.MORPHOLOGICAL_SUBSTITUTIONS['n']
+
+    def lemmatize(form):
+        if form in exceptions:
+            forms = exceptions[form]
+        else:
+            forms = [form[:len(form) - len(old)] + new for old, new in substitutions if form.endswith(old)]
+
+        #The distinct forms that are nouns, in order, and the first of the shortest of them
+        found = [form for form in dict.fromkeys([form] + forms) if form in nouns]
+
+        return min(found, key = len) if found else form
+
+    candidates = set(exceptions)
+
+    for noun in nouns:
+        for old, new in substitutions:
+            if noun.endswith(new):
+                candidates.add(noun[:len(noun) - len(new)] + old)
+
+    table = {}
+
+    for form in candidates:
+        lemma = lemmatize(form)
+
+        if lemma != form:
+            table[form] = lemma
+
+    return table
+
+
+def data_files(stopwords, wordnet):
+    """
+    This function returns the path, size and modification time of every NLTK data file a bundle is
+    built from: the English stop words, the VADER lexicon, and WordNet's noun files. A file inside a
+    zip archive is stood for by the archive.
+    """
+    import nltk.data
+
+    pointers = [stopwords.root.join('english'), nltk.data.find(vader_lexicon)]
+    pointers += [wordnet.root.join(name) for name in ['index.noun', 'data.noun', 'noun.exc']]
+
+    files = []
+
+    for pointer in pointers:
+        path = pointer.zipfile.filename if hasattr(pointer, 'zipfile') else pointer.path
+        stat = os.stat(path)
+
+        if [path, stat.st_size, stat.st_mtime] not in files:
+            files.append([path, stat.st_size, stat.st_mtime])
+
+    return files
+
+
+def changed_data(header):
+    """
+    This function returns the paths of the NLTK data files a bundle was built from that have changed,
+    or are gone, since it was built, going by the sizes and modification times in its header.
+    """
+    changed = []
+
+    for path, size, mtime in header['data_files']:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            changed.append(path)
+            continue
+
+        if stat.st_size != size or stat.st_mtime != mtime:
+            changed.append(path)
+
+    return changed
+
+
+def build(path = default_path, wordnet = None):
+    """
+    This function compiles the NLTK resources prepare.py uses into one file at path: the English stop
+    words, the Toktok tokenizer's substitutions, the VADER lexicon, and a table of WordNet noun lemmas
+    (see lemma_table). It needs NLTK and its data (stopwords, vader_lexicon, wordnet) installed.
+    Pass a loaded WordNet corpus reader as wordnet to use something other than nltk.corpus.wordnet.
+    The NLTK version and the data files used (see data_files) are recorded, so load can tell when
+    the bundle is out of date.
+    """
+    import nltk.sentiment
+    from nltk.corpus import stopwords
+    from nltk.tokenize.toktok import ToktokTokenizer
+
+    if wordnet is None:
+        from nltk.corpus import wordnet
+
+    lexicon = nltk.sentiment.SentimentIntensityAnalyzer().lexicon
+    lemmas = lemma_table(wordnet)
+
+    #Sorted keys can be searched in place, straight from the mapped file
+    vader_words = sorted(lexicon, key = lambda word: word.encode('utf-8'))
+    forms = sorted(lemmas, key = lambda word: word.encode('utf-8'))
+
+    arrays = {'vader_words': np.array([word.encode('utf-8') for word in vader_words], dtype = bytes),
+              'vader_scores': np.array([lexicon[word] for word in vader_words], dtype = np.float64),
+              'lemma_forms': np.array([form.encode('utf-8') for form in forms], dtype = bytes),
+              'lemma_values': np.array([lemmas[form].encode('utf-8') for form in forms], dtype = bytes)}
+
+    header = {'nltk_version': metadata.version('nltk'),
+              'data_files': data_files(stopwords, wordnet),
+              'stopwords': stopwords.words('english'),
+              'toktok': [[regexp.pattern, regexp.flags, substitution] for regexp, substitution in ToktokTokenizer.TOKTOK_REGEXES],
+              'arrays': {}}
+
+    #Lay the arrays out one after another, each starting on a 64 byte boundary
+    offset = 0
+
+    for name, array in arrays.items():
+        header['arrays'][name] = [offset, array.dtype.str, len(array)]
+        offset += -(-array.nbytes // 64) * 64
+
+    encoded = json.dumps(header).encode('utf-8')
+    start = -(-(len(magic) + 8 + len(encoded)) // 64) * 64
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(magic)
+        f.write(len(encoded).to_bytes(8, 'little'))
+        f.write(encoded)
+
+        for name, array in arrays.items():
+            f.seek(start + header['arrays'][name][0])
+            f.write(array.tobytes())
+
+        f.truncate(start + offset)
+
+    os.replace(path + '.tmp', path)
+
+
+class Tokenizer:
+    """
+    This class tokenizes text exactly as NLTK's ToktokTokenizer does, with the substitutions stored
+    in a bundle, so NLTK does not have to be imported.
+    """
+
+    def __init__(self, regexes):
+        self.regexes = [(re.compile(pattern, flags), substitution) for pattern, flags, substitution in regexes]
+
+    def tokenize(self, text, return_str = False):
+        text = str(text)
+
+        for regexp, substitution in self.regexes:
+            text = regexp.sub(substitution, text)
+
+        text = str(text.strip())
+
+        return text if return_str else text.split()
+
+
+class Lemmatizer:
+    """
+    This class lemmatizes words exactly as NLTK's WordNetLemmatizer does for nouns, by looking them
+    up in the sorted lemma table of a bundle. The table is searched where it lies in the mapped file,
+    so every process using the bundle shares the same memory. Other parts of speech are passed on
+    to NLTK.
+    """
+
+    def __init__(self, forms, values):
+        self.forms = forms
+        self.values = values
+
+    def lemmatize(self, word, pos = 'n'):
+        if pos != 'n':
+            import nltk
+
+            return nltk.stem.WordNetLemmatizer().lemmatize(word, pos)
+
+        key = word.encode('utf-8')
+        i = np.searchsorted(self.forms, key)
+
+        if i < len(self.forms) and self.forms[i] == key:
+            return self.values[i].decode('utf-8')
+
+        return word
+
+
+class Bundle:
+    """
+    This class opens a bundle written by build. The file is memory-mapped and its arrays are read
+    in place, so opening it is fast and worker processes share its pages instead of each loading
+    their own copy of the resources.
+    """
+
+    def __init__(self, path = default_path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if self.map[:len(magic)] != magic:
+            raise ValueError(f'{path} is not an NLP resource bundle of this version')
+
+        length = int.from_bytes(self.map[len(magic):len(magic) + 8], 'little')
+        self.header = json.loads(self.map[len(magic) + 8:len(magic) + 8 + length].decode('utf-8'))
+
+        start = -(-(len(magic) + 8 + length) // 64) * 64
+        self.arrays = {name: np.frombuffer(self.map, dtype = np.dtype(dtype), count = count, offset = start + offset)
+                       for name, (offset, dtype, count) in self.header['arrays'].items()}
+
+    def stopwords(self):
+        """
+        Return the English stop word list, as stopwords.words('english') does.
+        """
+        return list(self.header['stopwords'])
+
+    def tokenizer(self):
+        return Tokenizer(self.header['toktok'])
+
+    def lemmatizer(self):
+        return Lemmatizer(self.arrays['lemma_forms'], self.arrays['lemma_values'])
+
+    def lexicon(self):
+        """
+        Return the VADER lexicon as a dictionary. It is small, and VADER looks every word up in it
+        several times, so it is copied out of the bundle.
+        """
+        words = np.char.decode(self.arrays['vader_words'], 'utf-8').tolist()
+
+        return dict(zip(words, self.arrays['vader_scores'].tolist()))
+
+
+def load(path = None):
+    """
+    This function returns the Bundle at path (default_path by default), opening it only once per
+    process. It returns None if there is no bundle there, if it was built with another version of
+    NLTK, or if any of the NLTK data files it was built from has changed since (see changed_data),
+    in which case NLTK itself should be used.
+    """
+    path = default_path if path is None else path
+
+    if path not in bundles:
+        bundle = None
+
+        if os.path.exists(path):
+            bundle = Bundle(path)
+
+            if bundle.header['nltk_version'] != metadata.version('nltk'):
+                reason = f'was built with NLTK {bundle.header["nltk_version"]}'
+            elif 'data_files' not in bundle.header:
+                reason = 'does not record the NLTK data it was built from'
+            else:
+                changed = changed_data(bundle.header)
+                reason = f'was built from NLTK data that has changed since ({", ".join(changed)})' if changed else None
+
+            if reason is not None:
+                warnings.warn(f'{path} {reason}; rebuild it with python nlp_resources.py. Falling back to NLTK.')
+                bundle = None
+
+        bundles[path] = bundle
+
+    return bundles[path]
+
+
+def stopwords():
+    """
+    This function returns the English stop word list, from the bundle if there is one.
+    """
+    bundle = load()
+
+    if bundle is not None:
+        return bundle.stopwords()
+
+    from nltk.corpus import stopwords
+
+    return stopwords.words('english')
+
+
+def sentiment_analyzer():
+    """
+    This function returns a VADER SentimentIntensityAnalyzer, using the bundle's lexicon instead of
+    reading and parsing the lexicon file if there is a bundle.
+    """
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer, VaderConstants
+
+    bundle = load()
+
+    if bundle is None:
+        return SentimentIntensityAnalyzer()
+
+    #Skip __init__, which would read the lexicon file, and fill in what it would have set
+    analyzer = SentimentIntensityAnalyzer.__new__(SentimentIntensityAnalyzer)
+    analyzer.lexicon = bundle.lexicon()
+    analyzer.constants = VaderConstants()
+
+    return analyzer
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else default_path
+    build(path)
+
+    print(f'Wrote {os.path.getsize(path) / 1e6:.1f} MB of NLP resources to {path}')
@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+import joblib
+import prepare
+from streaming import feature_sets, hashing_vectorizer, read_prepared_chunks, stream_fit
+
+#The version of the saved pipeline format. Bump it whenever the files written by save change.
+format_version = 1
+
+
+class GenrePredictor:
+    """
+    This class holds a whole fitted genre classifier: the preparation settings (extra_words and
+    exclude_words), the vectorizer of one of streaming.feature_sets, and a fitted estimator. It is fit
+    on lemmatized blurbs, like the models in model_data.ipynb, and predicts the genre of raw blurbs,
+    preparing them exactly as prepare_articles would.
+
+    The TextPipeline is kept between calls, so NLTK is loaded only once and the lemma of every word
+    already seen is remembered. Blurbs are predicted batch_size at a time.
+
+    With n_features set, n-grams are hashed into that many columns by streaming.hashing_vectorizer
+    instead of being looked up in a vocabulary, as for estimators trained by streaming.stream_fit.
+    """
+
+    def __init__(self, estimator = None, feature_set = 'bow_bigrams', extra_words = [], exclude_words = [],
+                 batch_size = 256, n_features = None):
+        if estimator is None:
+            from sklearn.naive_bayes import MultinomialNB
+
+            estimator = MultinomialNB()
+
+        self.estimator = estimator
+        self.feature_set = feature_set
+        self.extra_words = list(extra_words)
+        self.exclude_words = list(exclude_words)
+        self.batch_size = batch_size
+        self.n_features = n_features
+
+        self.pipeline = prepare.TextPipeline(self.extra_words, self.exclude_words)
+        self.vocabulary = None
+        self.idf = None
+
+    def warm_up(self):
+        """
+        Make NLTK load WordNet now instead of on the first request, and lay out the weights of a
+        naive Bayes estimator for fast predictions.
+        """
+        self.pipeline.lemmatizer.lemmatize('books')
+
+        #Predicting multiplies the features by the transposed weights, and scipy copies them on every
+        #call unless the transpose is already C-ordered. That copy dominates with hashed features.
+        if hasattr(self.estimator, 'feature_log_prob_'):
+            self.estimator.feature_log_prob_ = np.asfortranarray(self.estimator.feature_log_prob_)
+
+        return self
+
+    def featurize(self, lemmatized, fit = False):
+        """
+        Return the feature matrix of a list of lemmatized blurbs. With fit = True the vocabulary
+        (and idf) are learned from them first.
+        """
+        if self.n_features:
+            return hashing_vectorizer(self.feature_set, self.n_features).transform(lemmatized)
+
+        kind, ngram_range = feature_sets[self.feature_set]
+        corpus = prepare.TokenCorpus.from_texts(lemmatized)
+
+        if fit:
+            self.vocabulary = self.idf = None
+
+        if kind == 'tfidf':
+            X, self.vocabulary, self.idf = corpus.tfidf(ngram_range, self.vocabulary, self.idf)
+        else:
+            X, self.vocabulary = corpus.counts(ngram_range, self.vocabulary)
+
+        return X
+
+    def fit(self, lemmatized, genres):
+        """
+        Fit the vectorizer and the estimator on lemmatized blurbs (the lemmatized column of
+        prepare_articles) and their genres.
+        """
+        self.estimator.fit(self.featurize(list(lemmatized), fit = True), np.asarray(genres))
+
+        return self
+
+    def prepare(self, blurbs):
+        """
+        Return the lemmatized version of every raw blurb.
+        """
+        return [self.pipeline.lemmatized(blurb) for blurb in blurbs]
+
+    def predict(self, blurbs):
+        """
+        Return the predicted genre of every raw blurb in blurbs, in order. A single string
+        gets a single genre back.
+        """
+        if isinstance(blurbs, str):
+            return self.predict([blurbs])[0]
+
+        blurbs = list(blurbs)
+        genres = []
+
+        for i in range(0, len(blurbs), self.batch_size):
+            X = self.featurize(self.prepare(blurbs[i:i + self.batch_size]))
+            genres.extend(self.estimator.predict(X).tolist())
+
+        return genres
+
+    def save(self, directory):
+        """
+        Save the fitted pipeline to a directory: pipeline.json holds the settings, features.npz
+        the vocabulary (and idf), and model.joblib the estimator.
+        """
+        os.makedirs(directory, exist_ok = True)
+
+        settings = {'format_version': format_version,
+                    'prepare_version': prepare.stage_versions['prepare'],
+                    'feature_set': self.feature_set,
+                    'extra_words': self.extra_words,
+                    'exclude_words': self.exclude_words,
+                    'batch_size': self.batch_size,
+                    'n_features': self.n_features}
+
+        #Store the n-grams in column order, so the vocabulary is just their positions
+        arrays = {}
+
+        if self.vocabulary is not None:
+            names = np.empty(len(self.vocabulary), dtype = object)
+            names[list(self.vocabulary.values())] = list(self.vocabulary)
+            arrays['names'] = names.astype(str)
+
+        if self.idf is not None:
+            arrays['idf'] = self.idf
+
+        #Write every file next to its final name first, so a failed save never leaves a broken pipeline
+        with open(os.path.join(directory, 'pipeline.json.tmp'), 'w') as f:
+            json.dump(settings, f)
+
+        np.savez(os.path.join(directory, 'features.tmp.npz'), **arrays)
+        self.warm_up()
+        joblib.dump(self.estimator, os.path.join(directory, 'model.joblib.tmp'))
+
+        os.replace(os.path.join(directory, 'features.tmp.npz'), os.path.join(directory, 'features.npz'))
+        os.replace(os.path.join(directory, 'model.joblib.tmp'), os.path.join(directory, 'model.joblib'))
+        os.replace(os.path.join(directory, 'pipeline.json.tmp'), os.path.join(directory, 'pipeline.json'))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Load a pipeline saved by save, ready to predict. The estimator's arrays are memory-mapped
+        rather than read, so even a large model loads quickly.
+        """
+        with open(os.path.join(directory, 'pipeline.json')) as f:
+            settings = json.load(f)
+
+        if settings['format_version'] != format_version:
+            raise ValueError(f"{directory} was saved in format {settings['format_version']}, expected {format_version}")
+
+        #Blurbs must be prepared the same way the model's training blurbs were
+        if settings['prepare_version'] != prepare.stage_versions['prepare']:
+            raise ValueError(f'{directory} was fit on blurbs from an older prepare stage; refit it')
+
+        predictor = cls(joblib.load(os.path.join(directory, 'model.joblib'), mmap_mode = 'r'), settings['feature_set'],
+                        settings['extra_words'], settings['exclude_words'], settings['batch_size'],
+                        settings.get('n_features'))
+
+        with np.load(os.path.join(directory, 'features.npz')) as data:
+            if 'names' in data:
+                predictor.vocabulary = {name: column for column, name in enumerate(data['names'].tolist())}
+
+            if 'idf' in data:
+                predictor.idf = data['idf']
+
+        return predictor.warm_up()
+
+
+class MicroBatcher:
+    """
+    This class lets many threads ask a GenrePredictor for one genre at a time, and answers them
+    in batches. A background thread waits up to max_wait seconds after the first waiting blurb
+    for more to arrive (or until batch_size are waiting), then predicts them all in one call.
+    """
+
+    def __init__(self, predictor, batch_size = None, max_wait = 0.002):
+        self.predictor = predictor
+        self.batch_size = predictor.batch_size if batch_size is None else batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def submit(self, blurb):
+        """
+        Queue a raw blurb and return a Future that will hold its genre.
+        """
+        future = Future()
+        self.requests.put((blurb, future))
+
+        return future
+
+    def predict(self, blurb):
+        """
+        Return the genre of one raw blurb, waiting for its batch to be predicted.
+        """
+        return self.submit(blurb).result()
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+
+            #None is the signal to stop
+            if batch[0] is None:
+                return
+
+            deadline = time.perf_counter() + self.max_wait
+
+            while len(batch) < self.batch_size:
+                try:
+                    request = self.requests.get(timeout = max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    self.requests.put(None)
+                    break
+
+                batch.append(request)
+
+            try:
+                genres = self.predictor.predict([blurb for blurb, future in batch])
+            except Exception as error:
+                for blurb, future in batch:
+                    future.set_exception(error)
+            else:
+                for (blurb, future), genre in zip(batch, genres):
+                    future.set_result(genre)
+
+    def close(self):
+        """
+        Answer every blurb already queued, then stop the background thread.
+        """
+        self.requests.put(None)
+        self.thread.join()
+
+
+def latency_report(predictor, blurbs, batch_size = None, repeat = 3):
+    """
+    This function times predictor.predict on blurbs split into requests of batch_size blurbs, repeat
+    times over, and returns a dictionary with the blurbs predicted per second and the 50th and 99th
+    percentile latency of a request in milliseconds.
+    """
+    batch_size = predictor.batch_size if batch_size is None else batch_size
+    blurbs = list(blurbs)
+    latencies = []
+
+    time_start = time.perf_counter()
+
+    for i in range(repeat):
+        for j in range(0, len(blurbs), batch_size):
+            request_start = time.perf_counter()
+            predictor.predict(blurbs[j:j + batch_size])
+            latencies.append(time.perf_counter() - request_start)
+
+    seconds = time.perf_counter() - time_start
+
+    return {'batch_size': batch_size,
+            'blurbs_per_sec': round(repeat * len(blurbs) / seconds, 1),
+            'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3)}
+
+
+def read_blurbs(paths):
+    """
+    This function yields the blurbs in the given files (or standard input), one per line.
+    """
+    for path in paths or ['-']:
+        f = sys.stdin if path == '-' else open(path)
+
+        try:
+            for line in f:
+                yield line.rstrip('\n')
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = 'Train, run, and time the book genre classifier.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    train = commands.add_parser('train', help = 'fit a pipeline on prepared blurbs and save it')
+    train.add_argument('pipeline', help = 'directory to save the pipeline in')
+    train.add_argument('--data', default = 'cleaned_book_blurbs.csv', help = 'csv with lemmatized and genre columns')
+    train.add_argument('--feature-set', default = 'bow_bigrams', choices = list(feature_sets))
+    train.add_argument('--alpha', type = float, default = 1.0, help = 'MultinomialNB smoothing')
+    train.add_argument('--stream', action = 'store_true', help = 'train chunk by chunk on hashed features')
+    train.add_argument('--chunk-size', type = int, default = 10000, help = 'rows per chunk with --stream')
+    train.add_argument('--n-features', type = int, default = 2 ** 20, help = 'hashed columns with --stream')
+
+    run = commands.add_parser('predict', help = 'print the genre of each blurb, one blurb per line')
+    run.add_argument('pipeline', help = 'directory of a saved pipeline')
+    run.add_argument('files', nargs = '*', help = 'files of blurbs, one per line (default: standard input)')
+    run.add_argument('--batch-size', type = int)
+
+    bench = commands.add_parser('benchmark', help = 'report throughput and p50/p99 request latency')
+    bench.add_argument('pipeline', help = 'directory of a saved pipeline')
+    bench.add_argument('--data', default = 'cleaned_book_blurbs.csv', help = 'csv with an original column')
+    bench.add_argument('--batch-size', type = int, nargs = '+', default = [1, 16, 256])
+    bench.add_argument('--repeat', type = int, default = 3)
+
+    args = parser.parse_args(args)
+
+    if args.command == 'train':
+        from sklearn.naive_bayes import MultinomialNB
+
+    if args.command == 'train' and args.stream:
+        #A first pass over just the genre column finds every class partial_fit must know about up front
+        classes = sorted(set().union(*[set(chunk.genre.dropna()) for chunk in
+                                       pd.read_csv(args.data, usecols = ['genre'], chunksize = args.chunk_size)]))
+
+        estimator, history = stream_fit(read_prepared_chunks(args.data, args.chunk_size), classes,
+                                        MultinomialNB(alpha = args.alpha), args.feature_set, args.n_features)
+
+        predictor = GenrePredictor(estimator, args.feature_set, n_features = args.n_features)
+        predictor.save(args.pipeline)
+
+        print(history.to_string(index = False))
+        print(f'Saved a hashed {args.feature_set} pipeline fit on {history.rows.sum()} blurbs to {args.pipeline}')
+
+    elif args.command == 'train':
+        blurbs = pd.read_csv(args.data).dropna(subset = ['lemmatized', 'genre'])
+
+        predictor = GenrePredictor(MultinomialNB(alpha = args.alpha), args.feature_set)
+        predictor.fit(blurbs.lemmatized, blurbs.genre).save(args.pipeline)
+
+        print(f'Saved a {args.feature_set} pipeline fit on {len(blurbs)} blurbs to {args.pipeline}')
+
+    elif args.command == 'predict':
+        predictor = GenrePredictor.load(args.pipeline)
+
+        if args.batch_size:
+            predictor.batch_size = args.batch_size
+
+        #Stream the input, predicting one batch of lines at a time
+        batch = []
+
+        for blurb in read_blurbs(args.files):
+            batch.append(blurb)
+
+            if len(batch) == predictor.batch_size:
+                print('\n'.join(predictor.predict(batch)), flush = True)
+                batch = []
+
+        if batch:
+            print('\n'.join(predictor.predict(batch)), flush = True)
+
+    else:
+        time_start = time.perf_counter()
+        predictor = GenrePredictor.load(args.pipeline)
+        load_seconds = time.perf_counter() - time_start
+
+        blurbs = pd.read_csv(args.data).original.dropna().tolist()
+
+        #Predict everything once first, so the lemma cache is as warm as it would be in service
+        predictor.predict(blurbs)
+
+        results = pd.DataFrame([latency_report(predictor, blurbs, batch_size, args.repeat) for batch_size in args.batch_size])
+
+        print(f'Loaded in {load_seconds * 1000:.1f} ms')
+        print(results.to_string(index = False))
+
+
+if __name__ == '__main__':
+    main()
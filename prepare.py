@@ -1,12 +1,23 @@
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-import nltk
-import nltk.sentiment
-from nltk.tokenize.toktok import ToktokTokenizer
-from nltk.corpus import stopwords
+from scipy import sparse
 import unicodedata
 import re
+import os
+import glob
+import time
+import hashlib
+import sqlite3
+import json
+import array
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import nlp_resources
+import metrics
+
+#NLTK and scikit-learn take seconds to import, so they are imported inside the functions that use
+#them, and the NLTK data comes from the compiled bundle in nlp_resources whenever it has been built
 
 def basic_clean(string):
     """
@@ -34,6 +45,8 @@ def tokenize(string):
     tokenized string.
     """
     
+    import nltk
+
     #Create the tokenizer
     tokenizer = nltk.tokenize.ToktokTokenizer()
     
@@ -47,6 +60,8 @@ def stem(string):
     This function will accept some text and return a stemmed version of the text.
     """
     
+    import nltk
+
     #Create porter stemmer
     ps = nltk.porter.PorterStemmer()
     
@@ -63,6 +78,8 @@ def lemmatize(string):
     This function accepts some text and returns the lemmatized version of the string.
     """
     
+    import nltk
+
     #Create the lemmatizer
     wnl = nltk.stem.WordNetLemmatizer()
     
@@ -79,6 +96,8 @@ def remove_stopwords(string, extra_words = [], exclude_words = []):
     This function will accept a string and return a version of the text without any stopwords.
     It will also allow the user to add extra words to remove or exclude words from the removal list.
     """
+    from nltk.corpus import stopwords
+
     #Get the standard english stop word list from nltk
     stop_words = stopwords.words('english')
     
@@ -101,41 +120,206 @@ def remove_stopwords(string, extra_words = [], exclude_words = []):
     
     return filtered_string
 
-def prepare_articles(df, col, extra_words = [], exclude_words = []):
+class TextPipeline:
+    """
+    This class prepares text the same way basic_clean, tokenize, stem, lemmatize, and remove_stopwords
+    do, but in a single pass. The tokenizer, stemmer, lemmatizer, and stop word set are created once,
+    and every word is stemmed and lemmatized only the first time it is seen. The output is identical
+    to running the separate functions.
+
+    If the NLP resource bundle has been built (see nlp_resources), the tokenizer, lemmatizer, and stop
+    words come from it and NLTK is never imported unless stems are needed.
+    """
+
+    def __init__(self, extra_words = [], exclude_words = []):
+        bundle = nlp_resources.load()
+
+        if bundle is not None:
+            self.tokenizer = bundle.tokenizer()
+            self.lemmatizer = bundle.lemmatizer()
+        else:
+            import nltk
+
+            self.tokenizer = nltk.tokenize.ToktokTokenizer()
+            self.lemmatizer = nltk.stem.WordNetLemmatizer()
+
+        #The stemmer is created the first time a word is stemmed
+        self.stemmer = None
+
+        #Build the stop word list exactly as remove_stopwords does, then freeze it for fast lookups
+        stop_words = nlp_resources.stopwords()
+
+        for word in extra_words:
+            stop_words.append(word)
+
+        for word in exclude_words:
+            stop_words.remove(word)
+
+        self.stop_words = frozenset(stop_words)
+
+        #Remember the stem and lemma of every word already seen
+        self.stems = {}
+        self.lemmas = {}
+
+    def stem(self, word):
+        try:
+            return self.stems[word]
+        except KeyError:
+            if self.stemmer is None:
+                import nltk
+
+                self.stemmer = nltk.porter.PorterStemmer()
+
+            self.stems[word] = stemmed = self.stemmer.stem(word)
+            return stemmed
+
+    def lemmatize(self, word):
+        try:
+            return self.lemmas[word]
+        except KeyError:
+            self.lemmas[word] = lemma = self.lemmatizer.lemmatize(word)
+            return lemma
+
+    def prepare(self, string):
+        """
+        Return the clean, stemmed, and lemmatized versions of one string, as prepare_articles makes them.
+        """
+        #Clean and tokenize the string once
+        words = self.tokenizer.tokenize(basic_clean(string))
+
+        stop_words = self.stop_words
+
+        clean = ' '.join([word for word in words if word not in stop_words])
+        stemmed = ' '.join([word for word in map(self.stem, words) if word not in stop_words])
+        lemmatized = ' '.join([word for word in map(self.lemmatize, words) if word not in stop_words])
+
+        return clean, stemmed, lemmatized
+
+    def lemmatized(self, string):
+        """
+        Return only the lemmatized version of one string, skipping the clean and stemmed versions.
+        """
+        stop_words = self.stop_words
+
+        return ' '.join([word for word in map(self.lemmatize, self.tokenizer.tokenize(basic_clean(string)))
+                         if word not in stop_words])
+
+    def transform(self, series):
+        """
+        Prepare every string in a series and return a dataframe with the clean, stemmed, and
+        lemmatized columns, on the same index.
+        """
+        return pd.DataFrame([self.prepare(string) for string in series],
+                            columns = ['clean', 'stemmed', 'lemmatized'],
+                            index = series.index)
+
+#The resources each worker process of a parallel run loads once, when it starts
+worker_state = {}
+
+def init_prepare_worker(extra_words, exclude_words):
+    """
+    This function runs once in each worker process used by prepare_articles. It builds the
+    worker's TextPipeline and makes NLTK load WordNet up front.
+    """
+    worker_state['pipeline'] = TextPipeline(extra_words, exclude_words)
+    worker_state['pipeline'].lemmatizer.lemmatize('books')
+
+def prepare_chunk(series):
+    """
+    This function prepares one chunk of text in a worker process.
+    """
+    return worker_state['pipeline'].transform(series)
+
+def map_chunks(func, data, workers, chunk_size, initializer = None, initargs = ()):
+    """
+    This function splits a series or dataframe into chunks of chunk_size rows, runs func on each
+    chunk in a pool of workers processes, and returns the results joined back together in the
+    original order.
+    """
+    chunks = [data.iloc[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers = workers, initializer = initializer, initargs = initargs) as pool:
+        results = list(pool.map(func, chunks))
+
+    return pd.concat(results)
+
+def prepare_articles(df, col, extra_words = [], exclude_words = [], workers = 1, chunk_size = 1000):
     """
     This function will take in a df and prepare the articles within. It will utilize the functions defined above and return the df with
     new columns for the original, cleaned, stemmed, and lemmatized versions of the content.
+
+    The work is done in one pass by a TextPipeline, which gives the same results as applying
+    basic_clean, tokenize, stem, lemmatize, and remove_stopwords one after another. With workers
+    greater than 1 the articles are split into chunks of chunk_size rows and prepared in that many
+    processes. The result is the same as preparing them in this process.
     """
 
     #rename the content column to be original
     df.rename(columns = {col:'original'}, inplace = True)
 
-    #create the 'clean' column
-    df['clean'] = df['original']
+    #create the clean, stemmed, and lemmatized columns
+    with metrics.stage('prepare_articles', len(df)):
+        if workers > 1 and len(df) > chunk_size:
+            prepared = map_chunks(prepare_chunk, df['original'], workers, chunk_size,
+                                  initializer = init_prepare_worker, initargs = (extra_words, exclude_words))
+        else:
+            prepared = TextPipeline(extra_words, exclude_words).transform(df['original'])
 
-    #apply the basic_clean, tokenize, and remove_stopwords functions
-    df['clean'] = df['clean'].apply(basic_clean)
-    df['clean'] = df['clean'].apply(tokenize)
+    df['clean'] = prepared['clean']
+    df['stemmed'] = prepared['stemmed']
+    df['lemmatized'] = prepared['lemmatized']
 
-    #create the stemmed column
-    df['stemmed'] = df['clean']
+    #Remove any entries that did not have a description
+    df.dropna(inplace = True)
 
-    #apply the stem function
-    df['stemmed'] = df['stemmed'].apply(stem).apply(remove_stopwords, extra_words = extra_words, exclude_words = exclude_words)
+    return df
 
-    #create the lematize column
-    df['lemmatized'] = df['clean']
+def read_chunks(directory, follow = False, poll = 5):
+    """
+    This function reads the chunk files written by acquire.acquire_to_chunks (or acquire.ChunkWriter)
+    and yields each one as a dataframe, in order. With follow = True it keeps waiting for new chunks,
+    checking every poll seconds, until the writer has marked the output as done. This allows the
+    chunks to be prepared while the crawl is still running.
 
-    #apply the lemmatize function
-    df['lemmatized'] = df['lemmatized'].apply(lemmatize).apply(remove_stopwords, extra_words = extra_words, exclude_words = exclude_words)
+    If the writer marked the output as failed, the chunks it finished are still read, and then a
+    RuntimeError is raised with the crawl's error.
+    """
+    #Keep track of the chunks that have already been handed out
+    seen = set()
 
-    #apply the remove_stopwords function to the 'clean' column
-    df['clean'] = df['clean'].apply(remove_stopwords, extra_words = extra_words, exclude_words = exclude_words)
+    while True:
+        #Check for the markers before listing, so no chunk written before them can be missed
+        done = os.path.exists(os.path.join(directory, 'done'))
+        failed = os.path.join(directory, 'failed')
+        failed = open(failed).read() if os.path.exists(failed) else None
 
-    #Remove any entries that did not have a description
-    df.dropna(inplace = True)
+        for path in sorted(glob.glob(os.path.join(directory, 'part-*'))):
+            #Skip chunks already read and chunks that are still being written
+            if path in seen or path.endswith('.tmp'):
+                continue
 
-    return df
+            seen.add(path)
+
+            if path.endswith('.parquet'):
+                yield pd.read_parquet(path)
+            else:
+                yield pd.read_json(path, lines = True, dtype = False)
+
+        if failed is not None:
+            raise RuntimeError(f'The crawl writing {directory} failed: {failed}')
+
+        if done or not follow:
+            return
+
+        time.sleep(poll)
+
+def prepare_chunks(directory, col = 'blurb', extra_words = [], exclude_words = [], follow = True, poll = 5):
+    """
+    This function runs prepare_articles on each chunk of crawled blurbs as soon as it has been written,
+    and yields the prepared dataframes one chunk at a time. See read_chunks for follow and poll.
+    """
+    for chunk in read_chunks(directory, follow = follow, poll = poll):
+        yield prepare_articles(chunk, col, extra_words = extra_words, exclude_words = exclude_words)
 
 def get_char_count(string):
     """
@@ -169,22 +353,111 @@ def get_sentence_count(string):
     """
     This function will take in a string and return the number of sentences in that string.
     """
+    import nltk
 
     sentences = nltk.sent_tokenize(string)
 
     return len(sentences)
 
+class SentimentScorer:
+    """
+    This class scores the sentiment of documents with VADER, loading the lexicon only once.
+    Documents are scored in batches, and every compound score is cached under a hash of the
+    text, so repeated blurbs and reruns are not scored twice. If path is given the cache is
+    also kept in a SQLite file, so it survives between runs and can be shared by the worker
+    processes of a parallel run.
+
+    The memory cache holds at most max_size scores, dropping the least recently used first, so a
+    long-lived scorer such as get_sentiment_compound's does not grow without end. max_size = None
+    keeps every score.
+    """
+
+    def __init__(self, path = None, max_size = 100000):
+        self.sia = nlp_resources.sentiment_analyzer()
+        self.scores = OrderedDict()
+        self.max_size = max_size
+        self.path = path
+        self.conn = None
+
+        if path is not None:
+            self.conn = sqlite3.connect(path, timeout = 60)
+            self.conn.execute('PRAGMA journal_mode = WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS scores (hash TEXT PRIMARY KEY, compound REAL)')
+            self.conn.commit()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def score(self, texts):
+        """
+        Return the compound sentiment score of every text in texts, in order.
+        """
+        keys = [self.key(text) for text in texts]
+
+        #Take the scores the memory cache holds, marking them as recently used
+        found = {}
+
+        for key in keys:
+            if key in self.scores and key not in found:
+                found[key] = self.scores[key]
+                self.scores.move_to_end(key)
+
+        #Find the texts that are not in the memory cache
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+
+        #Look them up in the cache file, in batches to stay under SQLite's limit on query parameters
+        if missing and self.conn is not None:
+            wanted = list(missing)
+
+            for i in range(0, len(wanted), 500):
+                batch = wanted[i:i + 500]
+                rows = self.conn.execute(f'SELECT hash, compound FROM scores WHERE hash IN ({",".join("?" * len(batch))})',
+                                         batch).fetchall()
+
+                for key, compound in rows:
+                    found[key] = compound
+                    del missing[key]
+
+        #Score whatever is left, and save it
+        if missing:
+            polarity_scores = self.sia.polarity_scores
+            new = {key: polarity_scores(text)['compound'] for key, text in missing.items()}
+            found.update(new)
+
+            if self.conn is not None:
+                self.conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?)', new.items())
+                self.conn.commit()
+
+        #Remember this batch, then drop the least recently used scores past max_size
+        self.scores.update(found)
+
+        if self.max_size is not None:
+            while len(self.scores) > self.max_size:
+                self.scores.popitem(last = False)
+
+        return [found[key] for key in keys]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+#The scorer shared by calls to get_sentiment_compound, created on first use
+default_scorer = None
+
 def get_sentiment_compound(string):
     """
     This function will take in a string, analyze the sentiment, and return the compound
-    value.
+    value. The VADER lexicon is loaded once, on the first call, and shared with later calls.
     """
-    
-    sia = nltk.sentiment.SentimentIntensityAnalyzer()
-    
-    #sia returns a dict, so access the compound score accordingly
-    compound = sia.polarity_scores(string)['compound']
-    
+    global default_scorer
+
+    if default_scorer is None:
+        default_scorer = SentimentScorer()
+
+    #the scorer works on batches, so pass a batch of one
+    compound = default_scorer.score([string])[0]
+
     return compound
 
 def get_stopword_count(string):
@@ -195,6 +468,8 @@ def get_stopword_count(string):
     #Create a list of the words in the string
     words = string.split()
     
+    from nltk.corpus import stopwords
+
     #Initialize the count var
     count = 0
     
@@ -207,41 +482,719 @@ def get_stopword_count(string):
     
     return count
 
-def prep_for_exploration(df):
+#The columns prep_for_exploration adds
+exploration_columns = ['lem_char_count', 'lem_word_count', 'lem_unique_word_count', 'sentence_count',
+                       'avg_words_per_sentence', 'sentiment', 'stopword_count', 'word_stopword_ratio']
+
+class FeatureEngine:
+    """
+    This class computes every exploration feature of prep_for_exploration in one pass over the
+    documents. The stop word set is loaded once, each document is split once, sentiment is scored
+    in one batch by a SentimentScorer, and the averages and ratios are computed on whole columns.
+    The numbers are identical to the per-row helper functions.
+    """
+
+    def __init__(self, scorer = None):
+        self.stop_words = frozenset(nlp_resources.stopwords())
+        self.scorer = scorer if scorer is not None else SentimentScorer()
+
+    def transform(self, df):
+        """
+        Return a dataframe of the exploration features of the original and lemmatized columns of df,
+        on the same index.
+        """
+        import nltk
+
+        stop_words = self.stop_words
+
+        char_counts = []
+        word_counts = []
+        unique_counts = []
+        sentence_counts = []
+        stopword_counts = []
+
+        for lemmatized, original in zip(df['lemmatized'], df['original']):
+            words = lemmatized.split()
+
+            char_counts.append(len(lemmatized))
+            word_counts.append(len(words))
+            unique_counts.append(len(set(words)))
+            sentence_counts.append(len(nltk.sent_tokenize(original)))
+            stopword_counts.append(sum([word in stop_words for word in original.split()]))
+
+        features = pd.DataFrame({'lem_char_count': char_counts,
+                                 'lem_word_count': word_counts,
+                                 'lem_unique_word_count': unique_counts,
+                                 'sentence_count': sentence_counts},
+                                index = df.index, dtype = 'int64')
+
+        #get the average number of words per sentence
+        features['avg_words_per_sentence'] = round(features.lem_word_count / features.sentence_count).astype(int)
+
+        #get the sentiment analysis compound scores of the original documents
+        features['sentiment'] = pd.Series(self.scorer.score(list(df['original'])), index = df.index, dtype = 'float64')
+        features['stopword_count'] = pd.Series(stopword_counts, index = df.index, dtype = 'int64')
+
+        #get the stop word to word ratio
+        features['word_stopword_ratio'] = round(features.stopword_count / features.lem_word_count, 2)
+
+        return features
+
+def init_explore_worker(sentiment_cache = None):
+    """
+    This function runs once in each worker process used by prep_for_exploration. It builds the
+    worker's FeatureEngine, with its own SentimentScorer, and makes NLTK load the sentence
+    tokenizer up front.
+    """
+    import nltk
+
+    worker_state['features'] = FeatureEngine(SentimentScorer(sentiment_cache))
+    nltk.sent_tokenize('Load the sentence tokenizer.')
+
+def explore_chunk(df):
+    """
+    This function computes the exploration features of one chunk of blurbs in a worker process.
+    """
+    return worker_state['features'].transform(df)
+
+def prep_for_exploration(df, workers = 1, chunk_size = 1000, sentiment_cache = None):
     """
     This function takes in the dataframe of prepared book blurbs and performs several functions to create features
     for exploration. This function will create columns for character counts, word counts, unique word counts,
     sentence counts, stop word counts, average number of words per sentence, stop word to word ratios, and 
     sentiment analysis compound scores.
 
+    The features are computed in one pass by a FeatureEngine. With workers greater than 1 the blurbs
+    are split into chunks of chunk_size rows and the features are computed in that many processes,
+    with the same results. sentiment_cache is the path of a SQLite file in which the sentiment
+    scores are cached between runs; by default they are cached only for the length of the call.
+
     It returns the updated dataframe.
     """
 
-    #get the character counts of the lemmatized documents
-    df['lem_char_count'] = df.lemmatized.apply(get_char_count)
+    with metrics.stage('prep_for_exploration', len(df)):
+        if workers > 1 and len(df) > chunk_size:
+            features = map_chunks(explore_chunk, df[['original', 'lemmatized']], workers, chunk_size,
+                                  initializer = init_explore_worker, initargs = (sentiment_cache,))
+        else:
+            scorer = SentimentScorer(sentiment_cache)
+            features = FeatureEngine(scorer).transform(df)
+            scorer.close()
+
+    for col in exploration_columns:
+        df[col] = features[col]
+
+    return df
 
-    #get the word counts of the lemmatized documents
-    df['lem_word_count'] = df.lemmatized.apply(get_word_count)
+class TokenCorpus:
+    """
+    This class holds a column of documents as integer tokens: vocab is the list of every distinct
+    token (interned once), ids is one flat array of the token ids of every document, and offsets
+    marks where each document starts and ends in ids, like the rows of a CSR matrix. Documents are
+    tokenized the way CountVectorizer and TfidfVectorizer tokenize them by default, so the count
+    and tfidf methods build the same matrices those vectorizers do, for any ngram_range, from a
+    single tokenization.
+    """
 
-    #get the unique word counts of the lemmatized documents
-    df['lem_unique_word_count'] = df.lemmatized.apply(get_unique_words)
+    def __init__(self, vocab, ids, offsets):
+        self.vocab = vocab
+        self.ids = ids
+        self.offsets = offsets
 
-    #get the sentence counts
-    df['sentence_count'] = df.original.apply(get_sentence_count)
+        #The n-grams of each order, kept so every featurization can share them
+        self.grams = {}
 
-    #get the average number of words per sentence
-    df['avg_words_per_sentence'] = round(df.lem_word_count / df.sentence_count).astype(int)
+    @classmethod
+    def from_texts(cls, texts, token_pattern = r"(?u)\b\w\w+\b"):
+        """
+        Tokenize every document in texts (for example the lemmatized column) and return the corpus.
+        """
+        pattern = re.compile(token_pattern)
+        vocab = {}
+        ids = array.array('i')
+        offsets = array.array('q', [0])
 
-    #get the sentiment analysis compound scores of the original documents
-    df['sentiment'] = df.original.apply(get_sentiment_compound)
+        for doc in texts:
+            #setdefault hands out the next id to every token not seen before
+            ids.extend([vocab.setdefault(token, len(vocab)) for token in pattern.findall(doc.lower())])
+            offsets.append(len(ids))
 
-    #get the stop word counts
-    df['stopword_count'] = df.original.apply(get_stopword_count)
+        return cls(list(vocab), np.frombuffer(ids, dtype = np.int32), np.frombuffer(offsets, dtype = np.int64))
 
-    #get the stop word to word ratio
-    df['word_stopword_ratio'] = round(df.stopword_count / df.lem_word_count, 2)
+    def __len__(self):
+        return len(self.offsets) - 1
 
-    return df
+    def subset(self, rows):
+        """
+        Return a corpus of just the given documents, in the given order, sharing this corpus's vocab.
+        Matrices built from it match vectorizers fit on just those documents.
+        """
+        rows = np.asarray(rows)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+
+        offsets = np.zeros(len(rows) + 1, dtype = np.int64)
+        np.cumsum(lengths, out = offsets[1:])
+
+        #The position in ids of every token of the chosen documents
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+
+        return TokenCorpus(self.vocab, self.ids[positions], offsets)
+
+    def save(self, path):
+        """
+        Save the corpus to a .npz file.
+        """
+        np.savez(path, vocab = np.array(self.vocab, dtype = str), ids = self.ids, offsets = self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a corpus saved by save.
+        """
+        with np.load(path) as data:
+            return cls(data['vocab'].tolist(), data['ids'], data['offsets'])
+
+    def ngrams(self, n):
+        """
+        Return the names of the distinct n-grams of the corpus, along with the document of every
+        n-gram occurrence and the position of its n-gram in the names.
+        """
+        if n in self.grams:
+            return self.grams[n]
+
+        lengths = np.diff(self.offsets)
+        docs = np.repeat(np.arange(len(self), dtype = np.int64), lengths)
+
+        #An n-gram can start at any position with n - 1 more tokens left in its document
+        starts = np.flatnonzero(np.arange(len(self.ids)) + n <= self.offsets[1:][docs])
+        grams = np.stack([self.ids[starts + k] for k in range(n)], axis = 1).astype(np.int64)
+
+        #Pack each n-gram into one integer when it fits, which makes finding the distinct ones much faster
+        size = max(len(self.vocab), 1)
+
+        if size ** n < 2 ** 63:
+            keys = np.zeros(len(starts), dtype = np.int64)
+
+            for k in range(n):
+                keys = keys * size + grams[:, k]
+
+            keys, first, inverse = np.unique(keys, return_index = True, return_inverse = True)
+            unique = grams[first]
+        else:
+            unique, inverse = np.unique(grams, axis = 0, return_inverse = True)
+
+        vocab = self.vocab
+        names = [' '.join([vocab[i] for i in gram]) for gram in unique.tolist()]
+
+        self.grams[n] = names, docs[starts], inverse.ravel()
+
+        return self.grams[n]
+
+    def counts(self, ngram_range = (1, 1), vocabulary = None):
+        """
+        Return the n-gram count matrix of the corpus and its vocabulary (a dictionary of n-gram to
+        column), matching CountVectorizer(ngram_range = ngram_range).fit_transform. Pass the
+        vocabulary of a fitted matrix to count only those n-grams instead, like transform.
+        """
+        names = []
+        rows = []
+        grams = []
+
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            gram_names, docs, inverse = self.ngrams(n)
+
+            rows.append(docs)
+            grams.append(inverse + len(names))
+            names.extend(gram_names)
+
+        rows = np.concatenate(rows)
+        grams = np.concatenate(grams)
+
+        if vocabulary is None:
+            if not names:
+                raise ValueError('empty vocabulary; perhaps the documents only contain stop words')
+
+            #CountVectorizer numbers its features in sorted order
+            order = sorted(range(len(names)), key = names.__getitem__)
+            vocabulary = {names[i]: column for column, i in enumerate(order)}
+            columns = np.empty(len(names), dtype = np.int64)
+            columns[order] = np.arange(len(names))
+            columns = columns[grams]
+
+            #fit_transform leaves each row's columns in the order the features were first seen
+            #(document by document, shorter n-grams first), and the tf-idf row norms are summed
+            #in that order, so lay the matrix out the same way
+            seen = np.argsort(rows, kind = 'stable')
+            first_seen = np.unique(columns[seen], return_index = True)[1]
+            layout = np.argsort(first_seen)
+        else:
+            columns = np.array([vocabulary.get(name, -1) for name in names], dtype = np.int64)[grams]
+
+            #Drop n-grams that are not in the given vocabulary
+            if (columns < 0).any():
+                rows = rows[columns >= 0]
+                columns = columns[columns >= 0]
+
+            #transform leaves each row's columns sorted
+            layout = np.arange(len(vocabulary))
+
+        #Sorting the (row, position) pairs puts each row's columns in layout order, and counts repeats
+        n_columns = len(vocabulary)
+        position = np.empty(n_columns, dtype = np.int64)
+        position[layout] = np.arange(n_columns)
+
+        cells, values = np.unique(rows * n_columns + position[columns], return_counts = True)
+
+        indptr = np.searchsorted(cells // n_columns, np.arange(len(self) + 1))
+        index_dtype = np.int32 if len(cells) < 2 ** 31 else np.int64
+
+        matrix = sparse.csr_matrix((values.astype(np.int64), layout[cells % n_columns].astype(index_dtype), indptr.astype(index_dtype)),
+                                   shape = (len(self), n_columns))
+
+        return matrix, vocabulary
+
+    def tfidf(self, ngram_range = (1, 1), vocabulary = None, idf = None):
+        """
+        Return the tf-idf matrix of the corpus, its vocabulary, and its idf weights, matching
+        TfidfVectorizer(ngram_range = ngram_range).fit_transform. Pass the vocabulary and idf
+        of a fitted matrix to weight new documents the same way, like transform.
+        """
+        matrix, vocabulary = self.counts(ngram_range, vocabulary)
+
+        if idf is None:
+            #Smoothed idf, computed exactly as TfidfTransformer computes it
+            df = np.bincount(matrix.indices, minlength = matrix.shape[1]).astype(np.float64)
+            df += 1.0
+
+            idf = np.full_like(df, fill_value = len(self) + 1)
+            idf /= df
+            np.log(idf, out = idf)
+            idf += 1.0
+
+        #Build the float copy from the arrays, since astype would sort each row's columns
+        matrix = sparse.csr_matrix((matrix.data.astype(np.float64), matrix.indices, matrix.indptr), shape = matrix.shape)
+        matrix.data *= idf[matrix.indices]
+
+        from sklearn.preprocessing import normalize
+
+        return normalize(matrix, norm = 'l2', copy = False), vocabulary, idf
+
+#The version of each stage. Bump one whenever its output changes, so the feature store
+#recomputes that stage instead of loading stale rows.
+stage_versions = {'prepare': 1, 'explore': 1}
+
+#Rows per row group in the feature store's part files. Smaller groups let a lookup skip more of
+#each file, at the cost of a larger footer.
+store_row_group_size = 1000
+
+class FeatureStore:
+    """
+    This class keeps the output of prepare_articles and prep_for_exploration in Parquet files, keyed
+    by a hash of each original blurb. Each stage is stored under a key made from extra_words,
+    exclude_words, and the stage's version, so changing any of them starts a fresh set of rows.
+    Only blurbs that are not in the store yet are prepared; the rest are read back from the store.
+
+    Rows are added as new part files inside directory/<stage>-<key>/, and compact merges them. Each
+    part is sorted by hash, so a lookup reads only the row groups that can hold the hashes it asks
+    for, and its cost grows with the number of parts rather than the number of stored rows.
+    """
+
+    def __init__(self, directory = 'feature_store', extra_words = [], exclude_words = []):
+        self.directory = directory
+        self.extra_words = list(extra_words)
+        self.exclude_words = list(exclude_words)
+
+        #The prepared text depends on the stop words, and the features depend on the prepared text
+        config = json.dumps([self.extra_words, self.exclude_words, stage_versions['prepare']])
+        self.keys = {'prepare': hashlib.sha1(config.encode('utf-8')).hexdigest()[:16]}
+
+        config = json.dumps([self.keys['prepare'], stage_versions['explore']])
+        self.keys['explore'] = hashlib.sha1(config.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def stage_dir(self, stage):
+        return os.path.join(self.directory, f'{stage}-{self.keys[stage]}')
+
+    @staticmethod
+    def read_part(path, hashes):
+        """
+        Return the rows of one part file whose hash is in hashes, a sorted array, reading only the
+        row groups whose range of hashes can hold one of them.
+        """
+        import pyarrow.parquet as pq
+
+        part = pq.ParquetFile(path)
+        column = part.metadata.schema.names.index('hash')
+        groups = []
+
+        for i in range(part.num_row_groups):
+            statistics = part.metadata.row_group(i).column(column).statistics
+
+            if statistics is None or not statistics.has_min_max:
+                groups.append(i)
+                continue
+
+            #The first requested hash at or above the group's minimum is the only one that can be in it
+            first = np.searchsorted(hashes, statistics.min)
+
+            if first < len(hashes) and hashes[first] <= statistics.max:
+                groups.append(i)
+
+        rows = part.read_row_groups(groups).to_pandas()
+
+        return rows[rows['hash'].isin(hashes)]
+
+    def load(self, stage, hashes = None):
+        """
+        Return the stored rows of a stage as a dataframe indexed by blurb hash: every row, or only
+        those whose hash is in hashes.
+        """
+        parts = sorted(glob.glob(os.path.join(self.stage_dir(stage), 'part-*.parquet')))
+
+        if not parts:
+            return None
+
+        if hashes is None:
+            stored = pd.concat([pd.read_parquet(path) for path in parts])
+        else:
+            hashes = np.unique(np.asarray(hashes, dtype = str))
+            stored = pd.concat([self.read_part(path, hashes) for path in parts])
+
+        return stored.drop_duplicates(subset = ['hash'], keep = 'last').set_index('hash')
+
+    def save(self, stage, rows):
+        """
+        Add rows, a dataframe with a hash column, to a stage as a new part file, sorted by hash.
+        """
+        directory = self.stage_dir(stage)
+        os.makedirs(directory, exist_ok = True)
+
+        path = os.path.join(directory, f'part-{time.time_ns()}.parquet')
+
+        #Write under a temporary name first so a reader never sees half a file
+        rows.sort_values('hash').to_parquet(path + '.tmp', index = False, row_group_size = store_row_group_size)
+        os.replace(path + '.tmp', path)
+
+    def compact(self):
+        """
+        Merge the part files of every stage into one file per stage. This also sorts parts written
+        before the store sorted them, so lookups can skip their row groups.
+        """
+        for stage in self.keys:
+            stored = self.load(stage)
+
+            if stored is None:
+                continue
+
+            old_parts = glob.glob(os.path.join(self.stage_dir(stage), 'part-*.parquet'))
+            self.save(stage, stored.reset_index())
+
+            for path in old_parts:
+                os.remove(path)
+
+    def lookup(self, stage, texts, compute):
+        """
+        Return the stored rows of a stage for every text in texts, in order. Texts that are not
+        stored yet are passed to compute, as a series indexed by hash, and its result is saved.
+        """
+        hashes = texts.map(self.key)
+        stored = self.load(stage, hashes.to_numpy())
+
+        #Select by position, since the index of texts may repeat labels, e.g. after pd.concat
+        if stored is None:
+            missing = np.arange(len(hashes))
+        else:
+            missing = np.flatnonzero(~hashes.isin(stored.index).to_numpy())
+
+        if len(missing):
+            #Only compute each new text once
+            new = texts.iloc[missing].groupby(hashes.iloc[missing].to_numpy(), sort = False).first()
+            new = compute(new)
+            new.index.name = 'hash'
+
+            self.save(stage, new.reset_index())
+
+            metrics.event('feature_store', f'{stage}: {len(new)} new rows, {len(hashes) - len(missing)} loaded from the store',
+                          stage = stage, new = len(new), loaded = len(hashes) - len(missing))
+
+            stored = new if stored is None else pd.concat([stored, new])
+
+            #Count the distinct texts actually computed and stored, not their repeats
+            metrics.count('store_rows', len(new), stage = stage, result = 'computed')
+
+        metrics.count('store_rows', len(hashes) - len(missing), stage = stage, result = 'loaded')
+
+        return stored.reindex(hashes.values)
+
+    def prepare_articles(self, df, col, workers = 1, chunk_size = 1000):
+        """
+        This method returns the same dataframe as prepare_articles, with the store's extra_words
+        and exclude_words, reading every blurb that was prepared before from the store.
+        """
+        df.rename(columns = {col:'original'}, inplace = True)
+
+        def compute(texts):
+            return prepare_articles(texts.to_frame('original'), 'original', self.extra_words, self.exclude_words,
+                                    workers = workers, chunk_size = chunk_size)[['clean', 'stemmed', 'lemmatized']]
+
+        prepared = self.lookup('prepare', df['original'], compute)
+
+        for column in ['clean', 'stemmed', 'lemmatized']:
+            df[column] = prepared[column].to_numpy()
+
+        #Remove any entries that did not have a description
+        df.dropna(inplace = True)
+
+        return df
+
+    def prep_for_exploration(self, df, workers = 1, chunk_size = 1000, sentiment_cache = None):
+        """
+        This method returns the same dataframe as prep_for_exploration, reading the features of every
+        blurb seen before from the store. df must have been prepared with the store's settings.
+        """
+        lemmatized = pd.Series(df['lemmatized'].to_numpy(), index = df['original'].map(self.key).to_numpy())
+        lemmatized = lemmatized[~lemmatized.index.duplicated()]
+
+        def compute(texts):
+            new = pd.DataFrame({'original': texts, 'lemmatized': lemmatized[texts.index]})
+
+            return prep_for_exploration(new, workers = workers, chunk_size = chunk_size,
+                                        sentiment_cache = sentiment_cache)[exploration_columns]
+
+        features = self.lookup('explore', df['original'], compute)
+
+        for column in exploration_columns:
+            df[column] = features[column].to_numpy()
+
+        return df
+
+class MinHashLSH:
+    """
+    This class finds near-duplicate documents without comparing every pair. Each document is turned
+    into the set of its shingles (runs of shingle_size words), and num_perm MinHash values summarize
+    that set: the share of MinHash values two documents have in common estimates the Jaccard
+    similarity of their shingle sets. The signatures are cut into bands, and only documents that
+    agree on a whole band are compared, so the work grows with the number of documents rather
+    than the number of pairs. The number of bands is picked so documents at least threshold similar
+    are very likely to share a band and dissimilar ones are not.
+    """
+
+    def __init__(self, threshold = 0.8, num_perm = 128, shingle_size = 3, seed = 123):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        #Each permutation is a multiply-shift hash: a random odd multiplier and offset, keeping the
+        #top 32 bits of the 64-bit result, which needs no slow modulo
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 2 ** 63, num_perm, dtype = np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, num_perm, dtype = np.uint64)
+
+        self.bands, self.rows = self.choose_bands(threshold, num_perm)
+
+    @staticmethod
+    def choose_bands(threshold, num_perm, miss_weight = 0.9):
+        """
+        Return the (bands, rows per band) that fit in num_perm and make the fewest weighted mistakes:
+        pairs below threshold that would be compared, plus pairs above it that would be missed.
+        Every compared pair has its similarity checked, so a missed pair counts miss_weight and
+        a compared one only 1 - miss_weight.
+        """
+        similarity = np.linspace(0, 1, 1001)
+        best = None
+
+        for bands in range(1, num_perm + 1):
+            for rows in range(1, num_perm // bands + 1):
+                #The chance two documents of each similarity share at least one band
+                found = 1 - (1 - similarity ** rows) ** bands
+                error = ((1 - miss_weight) * found[similarity < threshold].mean() * threshold
+                         + miss_weight * (1 - found[similarity >= threshold]).mean() * (1 - threshold))
+
+                if best is None or error < best[0]:
+                    best = (error, bands, rows)
+
+        return best[1], best[2]
+
+    def shingles(self, texts):
+        """
+        Return the document and hash of every distinct shingle of every document, sorted by document.
+        Documents shorter than shingle_size are a single shingle of all their words.
+        """
+        corpus = TokenCorpus.from_texts(texts, token_pattern = r"\S+")
+        k = self.shingle_size
+
+        #crc32 gives every word the same hash in every run
+        word_hashes = np.array([zlib.crc32(word.encode('utf-8')) for word in corpus.vocab], dtype = np.uint64)
+        words = word_hashes[corpus.ids] if len(corpus.ids) else np.zeros(0, dtype = np.uint64)
+
+        lengths = np.diff(corpus.offsets)
+        docs = np.repeat(np.arange(len(corpus), dtype = np.int64), lengths)
+        positions = np.arange(len(corpus.ids))
+        ends = corpus.offsets[1:][docs]
+
+        #A shingle starts at every position with k - 1 more words after it, and at the first word of shorter documents
+        starts = (positions + k <= ends) | ((positions == corpus.offsets[:-1][docs]) & (lengths[docs] < k))
+        starts = np.flatnonzero(starts)
+
+        hashes = np.zeros(len(starts), dtype = np.uint64)
+
+        for j in range(k):
+            inside = starts + j < ends[starts]
+            following = words[np.minimum(starts + j, max(len(words) - 1, 0))]
+            hashes = np.where(inside, ((hashes * np.uint64(1000003)) ^ following) & np.uint64(0xffffffff), hashes)
+
+        #Sort the (document, shingle) pairs and drop repeats
+        pairs = np.sort(docs[starts] << np.int64(32) | hashes.astype(np.int64))
+        pairs = pairs[np.concatenate([pairs[:1] == pairs[:1], pairs[1:] != pairs[:-1]])]
+
+        return pairs >> np.int64(32), (pairs & np.int64(0xffffffff)).astype(np.uint64)
+
+    def signatures(self, texts):
+        """
+        Return the MinHash signature of every document, one row of num_perm values each. Documents
+        with no words get a row of the largest value, which matches nothing.
+        """
+        texts = list(texts)
+        docs, hashes = self.shingles(texts)
+
+        signatures = np.full((len(texts), self.num_perm), 0xffffffff, dtype = np.uint32)
+
+        if len(docs) == 0:
+            return signatures
+
+        present, starts = np.unique(docs, return_index = True)
+
+        #Hash a block of permutations at a time to keep memory bounded
+        block = max(1, 2 ** 23 // len(hashes))
+
+        for i in range(0, self.num_perm, block):
+            a = self.a[i:i + block]
+            b = self.b[i:i + block]
+            values = ((hashes[:, np.newaxis] * a + b) >> np.uint64(32)).astype(np.uint32)
+            signatures[present, i:i + block] = np.minimum.reduceat(values, starts, axis = 0)
+
+        return signatures
+
+    def candidate_pairs(self, signatures):
+        """
+        Return every pair of documents (first, second) that agree on at least one whole band.
+        """
+        pairs = []
+
+        for band in range(self.bands):
+            keys = np.ascontiguousarray(signatures[:, band * self.rows:(band + 1) * self.rows])
+            keys = keys.view(np.dtype((np.void, keys.shape[1] * keys.itemsize))).ravel()
+
+            #Group the documents by their value for this band
+            order = np.argsort(keys, kind = 'stable')
+            keys = keys[order]
+            boundaries = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1], [True]]))
+
+            for start, end in zip(boundaries[:-1], boundaries[1:]):
+                if end - start > 1:
+                    members = order[start:end]
+                    first, second = np.triu_indices(len(members), 1)
+                    pairs.append(np.stack([members[first], members[second]], axis = 1))
+
+        if not pairs:
+            return np.zeros((0, 2), dtype = np.int64)
+
+        pairs = np.sort(np.concatenate(pairs), axis = 1)
+
+        return np.unique(pairs, axis = 0)
+
+    def clusters(self, texts):
+        """
+        Return the cluster of every document (the position of its cluster's first document) and the
+        pairs of documents found to be near duplicates, with their estimated similarity.
+        """
+        signatures = self.signatures(texts)
+        n = len(signatures)
+
+        #Documents with the same signature are compared once, so even a blurb repeated thousands
+        #of times only costs one entry in each band
+        unique, inverse = np.unique(signatures, axis = 0, return_inverse = True)
+        inverse = inverse.ravel()
+        representative = np.full(len(unique), n, dtype = np.int64)
+        np.minimum.at(representative, inverse, np.arange(n))
+
+        #Documents with no words are never duplicates of anything
+        empty = (unique == 0xffffffff).all(axis = 1)
+        rows = np.flatnonzero(~empty)
+
+        pairs = rows[self.candidate_pairs(unique[rows])]
+
+        #Keep the candidates whose signatures agree on at least threshold of their values
+        similarity = (unique[pairs[:, 0]] == unique[pairs[:, 1]]).mean(axis = 1)
+        pairs, similarity = pairs[similarity >= self.threshold], similarity[similarity >= self.threshold]
+
+        from scipy.sparse.csgraph import connected_components
+
+        graph = sparse.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape = (len(unique), len(unique)))
+        components = connected_components(graph, directed = False)[1][inverse]
+
+        #Give every empty document a cluster of its own
+        is_empty = empty[inverse]
+        components[is_empty] = components.max(initial = 0) + 1 + np.arange(is_empty.sum())
+
+        #Name each cluster after its first document
+        first = np.full(components.max(initial = 0) + 1, n, dtype = np.int64)
+        np.minimum.at(first, components, np.arange(n))
+
+        return first[components], pd.DataFrame({'first': representative[pairs[:, 0]],
+                                                 'second': representative[pairs[:, 1]],
+                                                 'similarity': similarity})
+
+def find_near_duplicates(df, col = 'clean', threshold = 0.8, num_perm = 128, shingle_size = 3):
+    """
+    This function finds the near-duplicate blurbs in a df with MinHashLSH, comparing the given column
+    (the clean blurbs by default). The same blurb often shows up for several editions, formats,
+    or sub-genres of one book.
+
+    It returns a Series holding the cluster of every row (the position of the cluster's first row)
+    and a report dataframe with one row per cluster of more than one blurb: its size, the positions
+    of its rows, their genres, the lowest similarity found between two of its rows, and its first
+    blurb. Rows are identified by position, not index label, since chunks concatenated from
+    prepare_chunks share labels.
+    """
+    lsh = MinHashLSH(threshold, num_perm, shingle_size)
+
+    with metrics.stage('find_near_duplicates', len(df)):
+        positions, pairs = lsh.clusters(df[col].fillna(''))
+
+    clusters = pd.Series(positions, index = df.index, name = 'cluster')
+
+    in_cluster = np.bincount(positions, minlength = len(df))[positions] > 1
+    duplicated = df.iloc[in_cluster].assign(cluster = positions[in_cluster])
+
+    pairs['cluster'] = positions[pairs['first']]
+
+    groups = duplicated.groupby('cluster', sort = False)
+    report = groups.agg(size = (col, 'size'), first_blurb = (col, 'first'))
+    report['rows'] = pd.Series(np.flatnonzero(in_cluster)).groupby(positions[in_cluster], sort = False).agg(list)
+
+    if 'genre' in df:
+        report['genres'] = groups.genre.unique().map(sorted)
+
+    #Clusters of identical blurbs have no pairs to compare, since their signatures are the same
+    report['min_similarity'] = pairs.groupby('cluster').similarity.min()
+    report['min_similarity'] = report['min_similarity'].fillna(1.0)
+
+    return clusters, report.sort_values('size', ascending = False).reset_index()
+
+def drop_near_duplicates(df, col = 'clean', threshold = 0.8, num_perm = 128, shingle_size = 3):
+    """
+    This function keeps only the first row of every cluster of near-duplicate blurbs found by
+    find_near_duplicates, so copies of one blurb cannot land on both sides of split. It returns the
+    deduplicated df.
+    """
+    positions = find_near_duplicates(df, col, threshold, num_perm, shingle_size)[0].to_numpy()
+
+    return df.iloc[positions == np.arange(len(df))]
 
 def split(blurbs):
     """
@@ -249,6 +1202,8 @@ def split(blurbs):
     It returns the train and test data frames.
     """
     
+    from sklearn.model_selection import train_test_split
+
     train, test = train_test_split(blurbs, stratify = blurbs.genre, test_size = .25, random_state = 123)
     
     return train, test
\ No newline at end of file
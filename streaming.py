@@ -0,0 +1,106 @@
+import time
+import numpy as np
+import pandas as pd
+
+#The helpers shared by model.py and predict.py. sklearn is only imported once a vectorizer or an
+#estimator is built, so predict.py loads without it.
+
+
+#The featurizations tried in model_data.ipynb: (vectorizer, ngram_range)
+feature_sets = {'bow': ('count', (1, 1)),
+                'bow_bigrams': ('count', (1, 2)),
+                'bow_trigrams': ('count', (1, 3)),
+                'bigrams_only': ('count', (2, 2)),
+                'trigrams_only': ('count', (3, 3)),
+                'tfidf': ('tfidf', (1, 1)),
+                'tfidf_bigrams': ('tfidf', (1, 2)),
+                'tfidf_trigrams': ('tfidf', (1, 3))}
+
+
+def hashing_vectorizer(feature_set = 'bow_bigrams', n_features = 2 ** 20):
+    """
+    This function returns a HashingVectorizer for one of the feature_sets. It hashes each n-gram
+    into one of n_features columns instead of keeping a vocabulary, so it needs no fitting and takes
+    the same memory however many documents it sees. Count feature sets give raw counts; tf-idf
+    feature sets give l2-normalized counts, since the idf weights would need a full pass over the data.
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    kind, ngram_range = feature_sets[feature_set]
+
+    return HashingVectorizer(n_features = n_features, ngram_range = ngram_range, alternate_sign = False,
+                             norm = 'l2' if kind == 'tfidf' else None)
+
+
+def read_prepared_chunks(path, chunk_size = 10000, text_col = 'lemmatized', target_col = 'genre'):
+    """
+    This function reads a csv of prepared blurbs (like cleaned_book_blurbs.csv) chunk_size rows at
+    a time, keeping only the text and target columns, and yields each chunk as a dataframe.
+    """
+    for chunk in pd.read_csv(path, usecols = [text_col, target_col], chunksize = chunk_size):
+        yield chunk.dropna()
+
+
+def shuffle_chunks(chunks, buffer_size = 50000, random_state = 123):
+    """
+    This function shuffles a stream of dataframes while holding at most about buffer_size rows.
+    Every chunk is mixed into the buffer, and once the buffer is full, as many random rows as the
+    chunk had are handed out. The crawl writes one genre after another, and models trained by
+    gradient descent need the genres mixed together to learn them all.
+    """
+    rng = np.random.default_rng(random_state)
+    buffer = None
+
+    for chunk in chunks:
+        buffer = chunk if buffer is None else pd.concat([buffer, chunk], ignore_index = True)
+
+        if len(buffer) >= buffer_size:
+            buffer = buffer.iloc[rng.permutation(len(buffer))]
+
+            yield buffer.iloc[:len(chunk)]
+
+            buffer = buffer.iloc[len(chunk):]
+
+    #Hand out whatever is left at the end
+    if buffer is not None and len(buffer):
+        yield buffer.iloc[rng.permutation(len(buffer))]
+
+
+def stream_fit(chunks, classes, estimator = None, feature_set = 'bow_bigrams', n_features = 2 ** 20,
+               text_col = 'lemmatized', target_col = 'genre'):
+    """
+    This function trains an estimator that supports partial_fit (a MultinomialNB by default) on a
+    stream of dataframes of prepared blurbs, such as read_prepared_chunks or prepare.prepare_chunks.
+    Each chunk is featurized with hashing_vectorizer and learned from, then dropped, so memory stays
+    the same however much data there is. classes must list every genre, since the first chunk
+    may not have them all.
+
+    Every chunk after the first is scored before it is learned from, which gives a running estimate
+    of accuracy on unseen blurbs. It returns the fitted estimator and a dataframe with one row per
+    chunk holding its size, that accuracy, and the rows learned per second.
+    """
+    if estimator is None:
+        from sklearn.naive_bayes import MultinomialNB
+
+        estimator = MultinomialNB()
+
+    vectorizer = hashing_vectorizer(feature_set, n_features)
+    classes = np.asarray(classes)
+    history = []
+
+    for k, chunk in enumerate(chunks):
+        time_start = time.perf_counter()
+
+        X = vectorizer.transform(chunk[text_col])
+        y = chunk[target_col].to_numpy()
+
+        accuracy = float(np.mean(estimator.predict(X) == y)) if k else np.nan
+
+        estimator.partial_fit(X, y, classes = classes)
+
+        seconds = time.perf_counter() - time_start
+
+        history.append({'chunk': k, 'rows': len(chunk), 'accuracy': accuracy,
+                        'rows_per_sec': round(len(chunk) / seconds, 1)})
+
+    return estimator, pd.DataFrame(history)